@@ -0,0 +1,274 @@
+# Copyright (c) 2015 CSEC (Comprehensive Sustainable Energy Committee), Town of Concord
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# The results of an analysis (see HeatPumpAnalysis.doHeatPumpAnalysis), kept as numbers: a column (numpy array) for
+# each quantity by year, the totals over the years, and the average and coldest heating years.
+#
+# The report is formatted only when asked for - text() for the tab separated report the program has always shown
+# and saved (also str()), csv() for the table by year, json() for everything - so that batch analyses which only
+# use the numbers do not pay for formatting them.
+#
+# The hourly series of an analysis can be written as columns (see writeHourly, HeatPumpAnalysis.exportHourly): an
+# .npz file - an int64 column of the hours (since 1970-01-01, local time) and a float32 column for each series, read
+# with readHourly or numpy.load - or CSV text, either optionally compressed.  The columns are converted and written
+# a chunk of hours at a time, so that no full size copy of them is made.
+
+import io
+import os
+import csv
+import gzip
+import json
+import zipfile
+from collections import OrderedDict
+
+import numpy as np
+
+# the columns by year: name, and what it is
+YEAR_COLUMNS = OrderedDict([
+    ('Year', "calendar year"),
+    ('BaseUnits', "baseline fuel used for heating, in its units"),
+    ('BaseCost', "cost of the baseline fuel"),
+    ('WaterUnits', "fuel (or KWh) for hot water"),
+    ('WaterCost', "cost of the hot water fuel"),
+    ('BLACKWh', "baseline air conditioning KWh"),
+    ('BLACCost', "cost of the baseline air conditioning"),
+    ('HPKWh', "heat pump KWh for heating"),
+    ('HPCost', "cost of the heat pump KWh"),
+    ('COP', "average heat pump COP"),
+    ('HPWaterKWh', "heat pump water heater KWh"),
+    ('HPWaterCost', "cost of the heat pump water heater KWh"),
+    ('SuppUses', "days the supplemental system is used"),
+    ('SuppUnits', "supplemental fuel used, in its units"),
+    ('SuppCost', "cost of the supplemental fuel"),
+    ('HPACKWh', "heat pump air conditioning KWh"),
+    ('HPACCost', "cost of the heat pump air conditioning"),
+    ('Savings', "saved by the change"),
+    ('BaseKgCO2', "kg CO2 of the baseline heating"),
+    ('BaseWaterKgCO2', "kg CO2 of the baseline hot water"),
+    ('BLACKgCO2', "kg CO2 of the baseline air conditioning"),
+    ('HPKgCO2', "kg CO2 of the heat pump heating"),
+    ('HPWaterKgCO2', "kg CO2 of the heat pump water heater"),
+    ('SuppKgCO2', "kg CO2 of the supplemental heating"),
+    ('HPACKgCO2', "kg CO2 of the heat pump air conditioning"),
+    ])
+
+# the hourly series of an analysis: attribute of HeatPumpAnalysis (those for the average or coldest year end in '1'),
+# and what it is
+HOURLY_SERIES = OrderedDict([
+    ('Q_required', "heating required, BTU/hr"),
+    ('QC_required', "cooling required, BTU/hr"),
+    ('capacity_Max', "maximum heat pump capacity, BTU/hr"),
+    ('capacity_Min', "minimum heat pump capacity, BTU/hr"),
+    ('electric_Required', "heat pump electricity, KWh"),
+    ('supplemental_Heat', "supplemental heat required, BTU/hr"),
+    ('COP_Ave', "average heat pump COP"),
+    ])
+HOUR_COLUMN = 'Hour'            # hours since 1970-01-01 (local time)
+INFO_COLUMN = 'Info'            # JSON text describing the series
+HOURLY_CHUNK = 4*8760           # hours converted and written at a time
+
+class AnalysisResults :
+    """Results of a heat pump analysis, by year, with the text, CSV and JSON reports made from them when asked for"""
+    def __init__(self, columns, summary, typicalYears, **layout) :
+        # columns: a sequence of values for each of YEAR_COLUMNS, one per year analyzed
+        # summary: totals over the years (see HeatPumpAnalysis.doHeatPumpAnalysis)
+        # typicalYears: a dictionary for each of the average and coldest heating years analyzed
+        # layout: what the report shows (the change analyzed, fuels and units, and which columns)
+        self.columns = OrderedDict((name, np.asarray(columns[name])) for name in YEAR_COLUMNS)
+        self.summary = summary
+        self.typicalYears = typicalYears
+        self.layout = layout
+        self._text = None
+
+    def __len__(self):
+        return len(self.columns['Year'])
+
+    def __getitem__(self, name):
+        # a column by year
+        return self.columns[name]
+
+    def __str__(self):
+        return self.text()
+
+    def text(self):
+        # the tab separated report, as shown by the program and saved in 'Output Data'
+        if self._text is None:
+            self._text = self.formatText()
+        return self._text
+
+    def formatText(self):
+        layout = self.layout
+        heatPumps = layout['heatPumps'] is not None
+        supplemental = heatPumps or layout['suppHeatType'] != layout['baseHeatType']
+        waterHeater = layout['waterHeaterCOP'] > 0
+
+        # header line
+        if heatPumps:
+            results = "\nAnalysis of heat pump performance for " + layout['heatPumps'] +"\n\n"
+        elif waterHeater:
+            results = "\nAnalysis of heat pump water heater, COP = %.1f\n\n" % (layout['waterHeaterCOP'])
+        else:
+            results = "\nAnalysis of supplemental heat system change to %s\n\n" % (layout['suppHeatType'])
+
+        # First line of table
+        results += "\tBaseline ("+layout['baseHeatType']+")\t\t"
+        if layout['waterUnits'] is not None:
+            results += "Hot Water\t\t"
+        if layout['baselineAC']:
+            results += "Air Conditioning\t\t"
+        results += " |  "
+        if heatPumps:
+            results += "Heat Pump\t\t\t"
+        if waterHeater:
+            results += "Hot Water\t\t"
+        if supplemental:
+            results += " |  "
+            results += "Supplemental ("+layout['suppHeatType']+")\t\t\t"
+        if heatPumps:
+            results += "Air Conditioning"
+        results +="\n"
+
+        # second line of table
+        results += "Year\t"+layout['baseUnits']+"\tCost\t"
+        if layout['waterUnits'] is not None:
+            results += layout['waterUnits']+"\tCost\t"
+        if layout['baselineAC']:
+            results += "kWh\tCost\t"
+        results += " |  "
+        if heatPumps:
+            results += "KWh\tCost\tCOP\t"
+        if waterHeater:
+            results += "KWh\tCost\t"
+        if supplemental:
+            results += " |  "
+            results += "#days\t"+layout['suppUnits']+"\tCost\t"
+        if heatPumps:
+            results += "kWh\tCost\t"
+        results += "\n"
+
+        # a line for each year
+        lines = [results]
+        c = dict((name, column.tolist()) for name, column in self.columns.items())
+        for Y in range(len(self)):
+            line = "%d\t%.0f\t$%.0f\t" % (c['Year'][Y], c['BaseUnits'][Y], c['BaseCost'][Y])
+            if layout['waterRows']:
+                line += "%.0f\t$%.0f\t" % (c['WaterUnits'][Y], c['WaterCost'][Y])
+            if layout['baselineAC'] and heatPumps:
+                line += "%.0f\t$%.0f\t" % (c['BLACKWh'][Y], c['BLACCost'][Y])
+            line += " |  "
+            if heatPumps:
+                line += "%.0f\t$%.0f\t%.1f\t" % (c['HPKWh'][Y], c['HPCost'][Y], c['COP'][Y])
+            if waterHeater:
+                line += "%.0f\t$%.0f\t" % (c['HPWaterKWh'][Y], c['HPWaterCost'][Y])
+            line += " |  "
+            if supplemental:
+                line += "%d\t%.0f\t$%.0f\t" % (c['SuppUses'][Y], c['SuppUnits'][Y], c['SuppCost'][Y])
+                if heatPumps and layout['heatPumpAC']:
+                    line += "%.0f\t$%.0f" % (c['HPACKWh'][Y], c['HPACCost'][Y])
+            lines.append(line + "\n")
+
+        summary = self.summary
+        lines.append("\nOver the years %d-%d, the %s would have %s $%.0f, emitting %.0f%% %s CO2eq than %s\n" % 
+                     (summary['FirstYear'], summary['LastYear'], layout['change'], savedOrCost(summary['Savings']), 
+                      abs(summary['Savings']), summary['CO2Percent'], lessOrMore(summary['CO2Percent']), layout['baseHeatType']))
+
+        for year in self.typicalYears:
+            line = "%s heating year (%d), heat pump covers " % (year['Name'], year['Year'])
+            line += "%.1f%% of heating load, %s $%.0f, " % (year['HeatPumpCoverage'], savedOrCost(year['Savings']), abs(year['Savings']))
+            line += "emits %.0f%% %s CO2 than %s\n" % (year['CO2Percent'], lessOrMore(year['CO2Percent']), layout['baseHeatType'])
+            lines.append(line)
+        return "".join(lines)
+
+    def csv(self, columns=None):
+        # the columns by year (all of them, or those named) as CSV text
+        columns = list(columns or YEAR_COLUMNS)
+        output = io.StringIO()
+        writer = csv.writer(output, lineterminator='\n')
+        writer.writerow(columns)
+        writer.writerows(zip(*(self.columns[name].tolist() for name in columns)))
+        return output.getvalue()
+
+    def asDict(self):
+        # everything, as plain lists and numbers
+        return OrderedDict([('layout', self.layout),
+                            ('years', OrderedDict((name, column.tolist()) for name, column in self.columns.items())),
+                            ('summary', self.summary),
+                            ('typicalYears', self.typicalYears)])
+
+    def json(self, **options):
+        # everything as JSON text (options as for json.dumps)
+        return json.dumps(self.asDict(), **options)
+
+def savedOrCost(savings):
+    if savings>0 :
+        return "saved"
+    return "cost an additional"
+
+def lessOrMore(CO2_percent_impact):
+    if CO2_percent_impact>0 :
+        return "less"
+    return "more"
+
+def writeHourly(filename, hours, columns, info=None, compress=False, chunkHours=HOURLY_CHUNK):
+    # write hourly series as columns: hours (int64 hours since 1970-01-01, or datetime64), and columns a dictionary of
+    # arrays of the same length, written as float32; a '.csv' or '.csv.gz' file is CSV text, otherwise an .npz file
+    # (compress: deflate it, or for CSV gzip it); info, a dictionary, is saved with them
+    hours = np.asarray(hours)
+    if hours.dtype != np.int64:
+        hours = hours.astype(np.int64)
+    tmpFile = "%s.%d" % (filename, os.getpid())
+    if filename.endswith('.csv') or filename.endswith('.csv.gz'):
+        opener = gzip.open if compress or filename.endswith('.gz') else open
+        with opener(tmpFile, 'wt', newline='') as output:
+            if info:
+                output.write("# " + json.dumps(info) + "\n")
+            output.write(",".join([HOUR_COLUMN] + list(columns)) + "\n")
+            for start in range(0, len(hours), chunkHours):
+                chunk = np.column_stack([hours[start:start+chunkHours]] + 
+                                        [np.asarray(column[start:start+chunkHours], dtype=np.float32) for column in columns.values()])
+                np.savetxt(output, chunk, fmt=['%d'] + ['%.7g']*len(columns), delimiter=',')
+    else:
+        compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        with zipfile.ZipFile(tmpFile, 'w', compression=compression, allowZip64=True) as archive:
+            writeColumn(archive, HOUR_COLUMN, hours, np.int64, chunkHours)
+            for name, column in columns.items():
+                writeColumn(archive, name, column, np.float32, chunkHours)
+            writeColumn(archive, INFO_COLUMN, np.array(json.dumps(info or {})), None, chunkHours)
+    os.replace(tmpFile, filename)
+
+def writeColumn(archive, name, column, dtype, chunkHours):
+    # one .npy member of an .npz file, converted to dtype a chunk at a time
+    column = np.asarray(column)
+    dtype = np.dtype(dtype or column.dtype)
+    with archive.open(name + '.npy', 'w', force_zip64=True) as output:
+        np.lib.format.write_array_header_1_0(output, {'descr':np.lib.format.dtype_to_descr(dtype), 
+                                                      'fortran_order':False, 'shape':column.shape})
+        if column.ndim==0:
+            output.write(column.astype(dtype).tobytes())
+        for start in range(0, len(column) if column.ndim else 0, chunkHours):
+            output.write(np.ascontiguousarray(column[start:start+chunkHours], dtype=dtype).tobytes())
+
+def readHourly(filename):
+    # (hours as datetime64[h], {name: column}, info) from an .npz file written by writeHourly
+    with np.load(filename) as data:
+        columns = OrderedDict((name, data[name]) for name in data.files if name not in (HOUR_COLUMN, INFO_COLUMN))
+        hours = data[HOUR_COLUMN].astype('datetime64[h]')
+        info = json.loads(str(data[INFO_COLUMN])) if INFO_COLUMN in data.files else {}
+    return hours, columns, info
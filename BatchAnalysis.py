@@ -0,0 +1,148 @@
+# Copyright (c) 2015 CSEC (Comprehensive Sustainable Energy Committee), Town of Concord
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Batch analysis: run every home in a directory of fuel delivery files (the 'Residential Profiles' format)
+# against a list of heat pump systems, without the user interface, and write one table of results.
+#
+# A system is an AHRI certificate number, or several joined with '+' for a multiple heat pump system, eg.
+#
+#   python BatchAnalysis.py "Residential Profiles" 7992954 8693480 7992954+8693480 -o results.csv
+#
+# The analyses run in a pool of processes.  The heat pump list and the climate library are loaded once per
+# process, and shared by all the analyses that process runs.  The climate data of each station is loaded when
+# first used, memory mapped from the binary cache, so homes near many different stations share one copy of each.
+
+import os
+import io
+import csv
+import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+
+from HeatPumpAnalysis import HeatPumpAnalysis
+
+RESULT_FIELDS = ['Home', 'Heat Pumps', 'Baseline', 'Baseline Units', 'Baseline Usage', 'Baseline Cost',
+                 'Heat Pump KWh', 'Heat Pump Cost', 'Supplemental Usage', 'Supplemental Cost', 'Savings', 'Error']
+
+# loaded once per process by loadShared()
+_heatPumps = None       # heat pump list, as from HeatPumpAnalysis.loadHeatPumps
+_catalog = None         # HeatPumpCatalog the list is from (for lookup by AHRI certificate number)
+_climateLibrary = None  # ClimateLibrary, with the default station's years loaded
+_dataRoot = None        # the data directory (see HeatPumpAnalysis.resolveDataRoot)
+
+def loadShared(dataRoot=None):
+    # load the heat pump list and climate data used by every analysis in this process
+    global _heatPumps, _catalog, _climateLibrary, _dataRoot
+    if _heatPumps is not None:
+        return
+    _dataRoot = dataRoot
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        hpa = HeatPumpAnalysis(loadDeliveries=False, dataRoot=dataRoot)
+        hpa.loadHeatPumps()
+        for year in hpa.climate.availableYears():
+            hpa.climate.loadYear(year)
+
+    _heatPumps = hpa.HPList
+    _catalog = hpa.catalog
+    _climateLibrary = hpa.climateLibrary
+
+def analyzeHome(purchasesFile, system, useBinMethod=False, hourlyDirectory=None):
+    # analyze one home with one heat pump system, returning a row of the results table
+    # useBinMethod: simulate by temperature bins rather than hour by hour (see HeatPumpAnalysis.binHours)
+    # hourlyDirectory: also write the hourly series there, as '<home>-<system>.npz' (see HeatPumpAnalysis.exportHourly)
+    loadShared()
+
+    row = {'Home': os.path.splitext(os.path.basename(purchasesFile))[0], 'Heat Pumps': system}
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            hpa = HeatPumpAnalysis(loadDeliveries=False, dataRoot=_dataRoot)
+            hpa.HPList = _heatPumps
+            hpa.climateLibrary = _climateLibrary
+            hpa.saveResults = False
+            hpa.useBinMethod = useBinMethod
+
+            if hpa.loadFuelDeliveries(purchasesFile)<=0:
+                raise ValueError("no fuel deliveries found")
+            for cert in system.split('+'):
+                index = _catalog.certificate(cert)
+                if index is None:
+                    raise ValueError("unknown AHRI certificate number "+cert)
+                hpa.HPChoice.append(_heatPumps[index])
+
+            hpa.doHeatPumpAnalysis()
+            if hourlyDirectory is not None:
+                hpa.exportHourly(os.path.join(hourlyDirectory, "%s-%s.npz" % (row['Home'], system)), compress=True)
+
+        # operating costs for the average heating year, as on the Economics page
+        baseCost = hpa.BaseAverageUnits*hpa.BaseCostPerUnit + hpa.BLACAverageUnits*hpa.STANDARD_PRICE_ELEC
+        heatPumpCost = hpa.HeatPumpAverageUnits*hpa.STANDARD_PRICE_ELEC
+        suppCost = hpa.SuppAverageUnits*hpa.SuppCostPerUnit
+
+        row['Heat Pumps'] = '+'.join(hp.Brand+'-'+hp.OutdoorUnit for hp in hpa.HPChoice)
+        row['Baseline'] = hpa.BaseHeatType
+        row['Baseline Units'] = hpa.BaseEnergyUnits
+        row['Baseline Usage'] = "%.0f" % hpa.BaseAverageUnits
+        row['Baseline Cost'] = "%.0f" % baseCost
+        row['Heat Pump KWh'] = "%.0f" % hpa.HeatPumpAverageUnits
+        row['Heat Pump Cost'] = "%.0f" % heatPumpCost
+        row['Supplemental Usage'] = "%.0f" % hpa.SuppAverageUnits
+        row['Supplemental Cost'] = "%.0f" % suppCost
+        row['Savings'] = "%.0f" % (baseCost - heatPumpCost - suppCost)
+    except Exception as e:
+        row['Error'] = str(e)
+    return row
+
+def runBatch(deliveryDirectory, systems, outputFile, processes=None, useBinMethod=False, dataRoot=None, hourlyDirectory=None):
+    # analyze every delivery file in deliveryDirectory with each heat pump system, writing a CSV table to outputFile
+    # dataRoot: the data directory with the heat pump listings and climate data (by default, see resolveDataRoot)
+    # hourlyDirectory: also write the hourly series of each analysis there (see analyzeHome)
+    homes = sorted(os.path.join(deliveryDirectory, name) for name in os.listdir(deliveryDirectory) if name.endswith('.txt'))
+    jobs = [(home, system) for home in homes for system in systems]
+
+    # loaded here first, so that forked worker processes start with it
+    loadShared(dataRoot)
+    if hourlyDirectory is not None:
+        os.makedirs(hourlyDirectory, exist_ok=True)
+    with ProcessPoolExecutor(processes, initializer=loadShared, initargs=(dataRoot,)) as pool:
+        rows = list(pool.map(analyzeHome, [job[0] for job in jobs], [job[1] for job in jobs], [useBinMethod]*len(jobs), 
+                             [hourlyDirectory]*len(jobs)))
+
+    with open(outputFile, 'w', newline='') as output:
+        writer = csv.DictWriter(output, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    print("%d analyses (%d homes, %d systems) written to %s" % (len(rows), len(homes), len(systems), outputFile))
+    return rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Analyze many homes and heat pump systems without the user interface")
+    parser.add_argument('deliveries', help="directory of fuel delivery files")
+    parser.add_argument('systems', nargs='+', help="AHRI certificate numbers, joined with '+' for multiple heat pumps")
+    parser.add_argument('-o', '--output', default='Batch Analysis.csv', help="results table (CSV)")
+    parser.add_argument('-j', '--processes', type=int, default=None, help="number of worker processes")
+    parser.add_argument('--bins', action='store_true', help="simulate by temperature bins rather than hour by hour")
+    parser.add_argument('--data', default=None, help="data directory (heat pump listings, 'Climate Data'), by default "
+                        "$HPAT_DATA or the directory of this program")
+    parser.add_argument('--hourly', default=None, help="directory for the hourly series of each analysis (.npz files)")
+    args = parser.parse_args()
+
+    runBatch(args.deliveries, args.systems, args.output, args.processes, args.bins, args.data, args.hourly)
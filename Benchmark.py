@@ -0,0 +1,270 @@
+# Copyright (c) 2015 CSEC (Comprehensive Sustainable Energy Committee), Town of Concord
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Benchmarks of the stages of the analysis: loading the heat pump catalog, the fuel deliveries and the temperature
+# data, the thermal resistance, the heat pump simulation and the whole analysis, for each home in a directory of
+# fuel delivery files and for a synthetic home with several decades of climate data, eg.
+#
+#   python Benchmark.py -o benchmark.json
+#   python Benchmark.py -o new.json --compare benchmark.json
+#
+# Each stage is timed over several runs (wall time), and run once more with tracemalloc on for the memory it
+# allocates (peak and net, in bytes - numpy arrays included); the peak resident memory of the process after
+# the stage is recorded too.  The results are written as JSON, with the git commit, so that runs on different
+# commits can be compared (--compare prints the change in time of each stage from an earlier file).
+# The bin method is also checked against the hourly simulation for each home (HeatPumpAnalysis.checkBinMethod):
+# the run exits with an error if it differs by more than BIN_TOLERANCE.
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import calendar
+import platform
+import contextlib
+import subprocess
+import tempfile
+import tracemalloc
+from datetime import date
+
+try:
+    import resource     # for the peak resident memory (not on Windows)
+except ImportError:
+    resource = None
+
+import numpy as np
+
+from HeatPumpAnalysis import HeatPumpAnalysis, HEAT_PUMP_LISTINGS, resolveDataRoot
+from ClimateData import ClimateStore, COMPLETE_YEAR, DEGREE_HOUR_BASE, DEFAULT_STATION
+
+DEFAULT_SYSTEM = '7992954'
+SYNTHETIC_FIRST_YEAR = 2002     # (the analysis starts no earlier than 2002)
+SYNTHETIC_HOME = 'Synthetic'
+
+STAGES = ('loadHeatPumps', 'loadFuelDeliveries', 'LoadTempDataRaw', 'approxResistance', 'heatPumpPerformance',
+          'heatPumpPerformance (bins)', 'doHeatPumpAnalysis', 'doHeatPumpAnalysis (unchanged)')
+
+def peakRSS():
+    # peak resident memory of this process so far, in kB (None where it isn't available)
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss//1024 if sys.platform=='darwin' else rss
+
+def measure(stage, setup, repeat, traced=True):
+    # wall time of stage() over repeat runs, with setup() before each (not timed), then a run with allocations traced
+    times = []
+    for i in range(repeat):
+        setup()
+        start = time.perf_counter()
+        stage()
+        times.append(time.perf_counter()-start)
+
+    result = {'runs':repeat, 'wall_min':min(times), 'wall_median':float(np.median(times)), 
+              'alloc_peak_bytes':None, 'alloc_net_bytes':None}
+    if traced:
+        setup()
+        tracemalloc.start()
+        try:
+            stage()
+            result['alloc_net_bytes'], result['alloc_peak_bytes'] = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    result['peak_rss_kb'] = peakRSS()
+    return result
+
+def benchmarkHome(purchasesFile, system, repeat, dataRoot=None):
+    # {stage: measurements} for one home
+    hpa = HeatPumpAnalysis(loadDeliveries=False, dataRoot=dataRoot)
+    hpa.saveResults = False
+
+    def unchanged():
+        pass
+    def reloadTemperatures():
+        # read from the binary cache each time
+        hpa.updateTemp = True
+        hpa.climate.years.clear()
+    def resimulate():
+        hpa.demandCache.clear()
+        hpa.performanceCache.clear()
+    def reanalyze():
+        reloadTemperatures()
+        resimulate()
+        hpa.updateResistance = True
+
+    results = {}
+    results['loadHeatPumps'] = measure(hpa.loadHeatPumps, unchanged, repeat)
+    results['loadFuelDeliveries'] = measure(lambda: hpa.loadFuelDeliveries(purchasesFile), unchanged, repeat)
+    if hpa.numDeliveries <= 0:
+        raise ValueError("no fuel deliveries found")
+    hpa.HPChoice = [hpa.HPList[hpa.catalog.certificate(cert)] for cert in system.split('+')]
+
+    results['LoadTempDataRaw'] = measure(hpa.LoadTempDataRaw, reloadTemperatures, repeat)
+    results['approxResistance'] = measure(hpa.approxResistance, unchanged, repeat)
+    results['heatPumpPerformance'] = measure(lambda: hpa.heatPumpPerformance(0), resimulate, repeat)
+    hpa.useBinMethod = True
+    results['heatPumpPerformance (bins)'] = measure(lambda: hpa.heatPumpPerformance(0), resimulate, repeat)
+    hpa.useBinMethod = False
+    results['doHeatPumpAnalysis'] = measure(hpa.doHeatPumpAnalysis, reanalyze, repeat)
+    results['doHeatPumpAnalysis (unchanged)'] = measure(hpa.doHeatPumpAnalysis, unchanged, repeat)
+
+    # parity of the bin method with the hourly simulation (see HeatPumpAnalysis.BIN_TOLERANCE)
+    try:
+        results['binMethodDifference'] = hpa.checkBinMethod()
+    except ValueError as e:
+        results['binMethodError'] = str(e)
+    return results
+
+def syntheticHome(directory, years, dataRoot=None):
+    # a data directory with years of climate data from SYNTHETIC_FIRST_YEAR on, each a complete year of the bundled
+    # station with the same number of days, the heat pump listings, and monthly oil deliveries through the period;
+    # returns the deliveries file
+    source = resolveDataRoot(dataRoot)
+    store = ClimateStore(source + 'Climate Data')
+    stats = store.degreeHours()
+    complete = [year for year in sorted(stats) if stats[year][0] >= COMPLETE_YEAR*8760]
+    if len(complete)==0:
+        raise ValueError("no complete years of climate data to copy")
+
+    for name in HEAT_PUMP_LISTINGS:
+        if os.path.exists(source + name):
+            shutil.copyfile(source + name, os.path.join(directory, name))
+    os.makedirs(os.path.join(directory, 'Climate Data'))
+    os.makedirs(os.path.join(directory, 'Residential Profiles'))
+
+    deliveries = []     # (date, gallons)
+    gallons = 0.
+    for i in range(years):
+        year = SYNTHETIC_FIRST_YEAR + i
+        sources = [y for y in complete if calendar.isleap(y)==calendar.isleap(year)] or complete
+        hours, temps = store.loadYear(sources[i % len(sources)])
+        days = (hours - hours[0])//24 + date(year,1,1).toordinal()
+
+        filename = os.path.join(directory, 'Climate Data', "%s-%d.txt" % (DEFAULT_STATION, year))
+        with open(filename, 'w', encoding='latin-1') as output:
+            output.write("ID = %s\tTMP F\n" % DEFAULT_STATION)
+            for hour, day, temp in zip((hours % 24).tolist(), days.tolist(), temps.tolist()):
+                d = date.fromordinal(day)
+                output.write("%d-%d-%d %d:55 EST\t%.1f\n" % (d.month, d.day, d.year, hour, temp))
+
+        # an oil delivery on the 25th of each month, for the heating since the last and some hot water
+        for day, temp in zip(days.tolist(), temps.tolist()):
+            gallons += max(DEGREE_HOUR_BASE - temp, 0.)/1500. + 0.01
+            d = date.fromordinal(day)
+            if d.day==25 and (len(deliveries)==0 or deliveries[-1][0]!=d):
+                deliveries.append((d, gallons))
+                gallons = 0.
+
+    purchasesFile = os.path.join(directory, 'Residential Profiles', SYNTHETIC_HOME+'.txt')
+    with open(purchasesFile, 'w', encoding='latin-1') as output:
+        output.write("Synthetic residence oil deliveries.\t\t\t\nHeat source: Fuel Oil\t\t\t\nYear\tDate\t$$\tGallons\n")
+        year = None
+        for d, gallons in deliveries:
+            output.write("%s\t%d/%d/%02d\t$%.2f\t%.1f\n" % (d.year if d.year!=year else '', d.month, d.day, d.year % 100, 
+                                                            3.*gallons, gallons))
+            year = d.year
+    return purchasesFile
+
+def gitCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def runBenchmarks(deliveryDirectory, system=DEFAULT_SYSTEM, repeat=3, years=30, dataRoot=None):
+    # the benchmark results: run information, and {home: {stage: measurements}} (or {'error': ...}) for each home
+    # in deliveryDirectory and the synthetic home (if years>0)
+    results = {'commit':gitCommit(), 'time':time.strftime('%Y-%m-%dT%H:%M:%S'), 'python':platform.python_version(), 
+               'numpy':np.__version__, 'platform':platform.platform(), 'system':system, 'repeat':repeat, 'homes':{}}
+
+    homes = sorted(os.path.join(deliveryDirectory, name) for name in os.listdir(deliveryDirectory) if name.endswith('.txt'))
+    for purchasesFile in homes:
+        home = os.path.splitext(os.path.basename(purchasesFile))[0]
+        print("Benchmarking "+home)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                results['homes'][home] = benchmarkHome(purchasesFile, system, repeat, dataRoot)
+        except Exception as e:
+            results['homes'][home] = {'error':str(e)}
+
+    if years > 0:
+        print("Benchmarking %s (%d years)" % (SYNTHETIC_HOME, years))
+        directory = tempfile.mkdtemp(prefix='hpat-benchmark-')
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                purchasesFile = syntheticHome(directory, years, dataRoot)
+                # the first load parses the station files into the binary cache
+                hpa = HeatPumpAnalysis(loadDeliveries=False, dataRoot=directory)
+                hpa.loadFuelDeliveries(purchasesFile)
+                parse = measure(hpa.LoadTempDataRaw, lambda: None, 1, traced=False)
+                synthetic = benchmarkHome(purchasesFile, system, repeat, directory)
+            synthetic['LoadTempDataRaw (parse)'] = parse
+            synthetic['years'] = years
+            results['homes'][SYNTHETIC_HOME] = synthetic
+        except Exception as e:
+            results['homes'][SYNTHETIC_HOME] = {'error':str(e)}
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+def compareBenchmarks(results, previous):
+    # print the median time of each stage against an earlier run
+    print("%-32s %-34s %10s %10s %8s" % ('Home', 'Stage', 'Before ms', 'Now ms', 'Change'))
+    for home, stages in results['homes'].items():
+        before = previous['homes'].get(home, {})
+        if before.get('years') != stages.get('years'):
+            continue        # a synthetic home of a different length
+        for stage, now in stages.items():
+            if not isinstance(now, dict) or not isinstance(before.get(stage), dict):
+                continue
+            a = before[stage]['wall_median']
+            b = now['wall_median']
+            print("%-32s %-34s %10.2f %10.2f %+7.0f%%" % (home[:32], stage, 1e3*a, 1e3*b, 100.*(b-a)/a if a>0 else 0.))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time the stages of the analysis for the bundled homes and a synthetic home")
+    parser.add_argument('-o', '--output', default='benchmark.json', help="results file (JSON)")
+    parser.add_argument('--deliveries', default=None, help="directory of fuel delivery files (default: 'Residential Profiles')")
+    parser.add_argument('--system', default=DEFAULT_SYSTEM, help="AHRI certificate numbers, joined with '+'")
+    parser.add_argument('-n', '--repeat', type=int, default=3, help="timed runs of each stage")
+    parser.add_argument('--years', type=int, default=30, help="years of synthetic climate data (0 for none)")
+    parser.add_argument('--compare', default=None, help="an earlier results file to compare with")
+    parser.add_argument('--data', default=None, help="data directory (see HeatPumpAnalysis.resolveDataRoot)")
+    args = parser.parse_args()
+
+    deliveries = args.deliveries or resolveDataRoot(args.data) + 'Residential Profiles'
+    results = runBenchmarks(deliveries, args.system, args.repeat, args.years, args.data)
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=1)
+    print("Results written to "+args.output)
+
+    if args.compare:
+        with open(args.compare, 'r') as input:
+            compareBenchmarks(results, json.load(input))
+
+    failed = [home for home, stages in results['homes'].items() if 'binMethodError' in stages]
+    for home in failed:
+        print("%s: %s" % (home, results['homes'][home]['binMethodError']))
+    if failed:
+        sys.exit(1)
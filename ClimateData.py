@@ -0,0 +1,471 @@
+# Copyright (c) 2015 CSEC (Comprehensive Sustainable Energy Committee), Town of Concord
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Hourly outdoor temperature data from MesoWest station files (Climate Data/<station>-<year>.txt)
+#
+# The stations are listed in Climate Data/stations.json, with their names and locations (latitude and
+# longitude), so that the station nearest a home can be used; a station with files but no entry there
+# is still available by its id.
+#
+# The text files are read one line at a time, and the readings turned into hourly temperatures as they
+# are read (see hourlyTemperatures), straight into arrays for the year.
+# Parsing is slow (one date string per observation), so the years not yet converted are parsed at the same
+# time in a pool of processes (see loadYears), and each station-year is converted once into a
+# binary .npy file in 'Climate Data/.cache', holding the first hour (hours since 1970-01-01, local
+# time) and the temperature (float32) for every hour of the year from then on.
+# The cached file is memory mapped when loaded, and rebuilt whenever the size or modification time
+# of the source text file changes.
+#
+# Heating and cooling degree-hours for each station-year are kept in another small file in the cache
+# directory, so that the typical (median) and extreme years can be chosen without loading the years.
+
+import os
+import json
+import math
+from datetime import date
+
+import numpy as np
+
+STATION_INDEX = 'stations.json'
+DEFAULT_STATION = 'KBED'
+
+CACHE_DIR = '.cache'
+CACHE_INDEX = 'index.json'
+CACHE_DEGREE_HOURS = 'degree-hours.json'
+
+DEGREE_HOUR_BASE = 65.      # deg F, for heating and cooling degree-hours
+FILLED_HOURS = 24           # more hours than this of the same temperature are taken as a gap in the readings
+COMPLETE_YEAR = 0.95        # fraction of the hours of a year with readings for the year to be ranked
+
+# ways of filling the hours in a gap in the readings (see hourlyTemperatures)
+GAP_POLICIES = ('fill', 'linear')
+
+EPOCH_DAY = date(1970,1,1).toordinal()
+
+def hourlyColumns(hours, temps):
+    # a single record holding the first hour and the temperature column, as saved in the cache
+    # (the hours of a year are consecutive)
+    columns = np.zeros((), dtype=[('first','<i8'),('temp','<f4',(len(temps),))])
+    columns['first'] = firstHourOf(1970) if len(hours)==0 else hours[0]
+    columns['temp'] = temps
+    return columns
+
+def distance(lat1, lon1, lat2, lon2):
+    # great circle distance between two locations (degrees), in km
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2-lat1)/2)**2 + math.cos(lat1)*math.cos(lat2)*math.sin((lon2-lon1)/2)**2
+    return 2*6371.*math.asin(math.sqrt(a))
+
+def readObservations(filename):
+    # the readings in a MesoWest text file, one at a time, as (minutes since 1970, temperature)
+    # As in the original loader: a reading without a temperature repeats the previous one, and reading stops at
+    # the first line without a valid date
+    days = {}
+    temp = None
+    with open(filename,'r',encoding='latin-1') as input:
+        input.readline()        # column headings
+        for line in input:
+            tokens = line.rstrip().split('\t')
+            try:
+                # date strings are of the form '1-1-2003 0:55 EST'
+                dayString, timeString = tokens[0][0:-4].split(' ')
+                month, day, yr = dayString.split('-')
+                hour, minute = timeString.split(':')
+                if len(yr)!=4 or len(minute)!=2 or len(hour)>2:
+                    break
+                hour = int(hour)
+                minute = int(minute)
+                if hour>23 or minute>59:
+                    break
+                key = (int(yr),int(month),int(day))
+                if key not in days:
+                    days[key] = date(*key).toordinal() - EPOCH_DAY
+            except:     # hit the line past the date lines
+                break
+
+            try:
+                temp = float(tokens[1])
+            except:
+                pass
+            if temp is None:
+                continue
+
+            yield (days[key]*24 + hour)*60 + minute, temp
+
+def hourlyTemperatures(observations, firstHour, gapPolicy='fill', maxGap=None):
+    # hourly (hours since 1970, temperature) from firstHour through the last of the readings (minutes, temperature)
+    # Each hour takes the temperature of the first reading after it, passing over readings no later than one before.
+    # An hour more than an hour before the next reading is in a gap in the readings: with gapPolicy 'fill' it takes
+    # that reading too (as the original loader), with 'linear' the temperature interpolated between the readings
+    # either side of the gap; hours in gaps longer than maxGap hours are NaN (missing) instead
+    if gapPolicy not in GAP_POLICIES:
+        raise ValueError("gapPolicy must be one of: "+", ".join(GAP_POLICIES))
+    hour = firstHour
+    reached = prevTemp = None       # time and temperature of the latest reading so far
+    for minute, temp in observations:
+        if reached is not None and minute <= reached:
+            continue
+        gap = minute - (firstHour*60 if reached is None else reached)
+        while hour*60 < minute:
+            value = temp
+            if minute - hour*60 > 60:
+                if maxGap is not None and gap > maxGap*60:
+                    value = np.nan
+                elif gapPolicy=='linear' and reached is not None:
+                    value = prevTemp + (temp-prevTemp)*(hour*60-reached)/(minute-reached)
+            yield hour, value
+            hour += 1
+        reached = minute
+        prevTemp = temp
+
+def firstHourOf(year):
+    # hours since 1970 at the start of Jan 1 of year
+    return (date(year,1,1).toordinal() - EPOCH_DAY)*24
+
+def hourlyRecords(files, gapPolicy='fill', maxGap=None):
+    # hourly (hours since 1970, temperature) from each of a sequence of (station file, year) in turn
+    for filename, year in files:
+        for record in hourlyTemperatures(readObservations(filename), firstHourOf(year), gapPolicy, maxGap):
+            yield record
+
+def parseStationFile(filename, year, gapPolicy='fill', maxGap=None):
+    # read a MesoWest text file, returning the hours (since 1970) and temperatures from Jan 1 of year
+    # into buffers sized for the year (extended if the file runs on past it)
+    size = firstHourOf(year+1) - firstHourOf(year) + 24
+    hours = np.empty(size, dtype=np.int64)
+    temps = np.empty(size, dtype=np.float32)
+    n = 0
+    for hour, temp in hourlyRecords([(filename, year)], gapPolicy, maxGap):
+        if n==len(hours):
+            hours = np.concatenate((hours, np.empty(size, dtype=np.int64)))
+            temps = np.concatenate((temps, np.empty(size, dtype=np.float32)))
+        hours[n] = hour
+        temps[n] = temp
+        n += 1
+    return hours[:n].copy(), temps[:n].copy()
+
+class ClimateStore :
+    """Hourly outdoor temperatures for a weather station, with a binary cache of the parsed files"""
+    def __init__(self, directory, station=DEFAULT_STATION, gapPolicy='fill', maxGap=None) :
+        self.directory = directory
+        self.station = station
+        self.gapPolicy = gapPolicy      # how gaps in the readings are filled (see hourlyTemperatures)
+        self.maxGap = maxGap
+        self.cacheDirectory = os.path.join(directory, CACHE_DIR)
+        self.years = {}     # station-year arrays already loaded in this process
+        self.processes = None       # processes parsing station files at once (None for one per core, see loadYears)
+        self.loads = {'parsed':0, 'cached':0, 'memory':0}   # station-years loaded, by where from (for instrumentation)
+
+    def stationFile(self, year):
+        return os.path.join(self.directory, "%s-%i.txt" % (self.station, year))
+
+    def availableYears(self):
+        # years for which there is a station file
+        prefix = self.station + '-'
+        years = []
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix) and name.endswith('.txt') and name[len(prefix):-4].isdigit():
+                years.append(int(name[len(prefix):-4]))
+        return sorted(years)
+
+    def cacheFile(self, year):
+        # one for each way of filling gaps
+        name = "%s-%i" % (self.station, year)
+        if self.gapPolicy!='fill':
+            name += "-"+self.gapPolicy
+        if self.maxGap is not None:
+            name += "-max%g" % self.maxGap
+        return os.path.join(self.cacheDirectory, name+".npy")
+
+    def readIndex(self, name=CACHE_INDEX):
+        try:
+            with open(os.path.join(self.cacheDirectory, name),'r') as input:
+                return json.load(input)
+        except (OSError, ValueError):
+            return {}
+
+    def writeIndex(self, index, name=CACHE_INDEX):
+        # replace the index file in one step, so that another process never sees it half written
+        indexFile = os.path.join(self.cacheDirectory, name)
+        tmpFile = "%s.%d" % (indexFile, os.getpid())
+        with open(tmpFile,'w') as output:
+            json.dump(index, output, indent=1, sort_keys=True)
+        os.replace(tmpFile, indexFile)
+
+    def sourceStamp(self, year):
+        # size and modification time of a station file, to tell when it has changed
+        source = os.stat(self.stationFile(year))
+        return [source.st_size, source.st_mtime_ns]
+
+    def updateIndex(self, entries):
+        # add entries to the index of the cache, as it is on disk now (so that entries another process has added since
+        # it was read are kept).  Two processes updating it at the same moment may still lose one's entries; the
+        # years concerned are then only parsed again when next loaded, and the cache rebuilt
+        index = self.readIndex()
+        index.update(entries)
+        self.writeIndex(index)
+
+    def readCache(self, year, index=None):
+        # load a year from the binary cache (memory mapped) if it is there and up to date, returning whether it was
+        # index: the cache index, if read already (see loadYears)
+        cacheFile = self.cacheFile(year)
+        if index is None:
+            index = self.readIndex()
+        if index.get(os.path.basename(cacheFile))!=self.sourceStamp(year):
+            return False
+        try:
+            data = np.load(cacheFile, mmap_mode='r')
+        except (OSError, ValueError):
+            return False
+        if data.dtype.names!=('first','temp'):
+            return False        # an older format
+
+        self.years[year] = (int(data['first']), data['temp'])
+        self.loads['cached'] += 1
+        return True
+
+    def saveYear(self, year, hours, temps, entries=None):
+        # keep a year parsed from its station file, and save it in the binary cache
+        # entries: a dictionary to add its cache index entry to, for the caller to write (otherwise it is written now)
+        data = hourlyColumns(hours, temps)
+        self.years[year] = (int(data['first']), data['temp'])
+        self.loads['parsed'] += 1
+
+        cacheFile = self.cacheFile(year)
+        try:
+            os.makedirs(self.cacheDirectory, exist_ok=True)
+            tmpFile = "%s.%d.npy" % (cacheFile[0:-4], os.getpid())
+            np.save(tmpFile, data)
+            os.replace(tmpFile, cacheFile)
+            entry = {os.path.basename(cacheFile): self.sourceStamp(year)}
+            if entries is None:
+                self.updateIndex(entry)
+            else:
+                entries.update(entry)
+        except OSError as e:
+            print("Unable to cache temperature data: %s" % e)
+
+    def loadYear(self, year):
+        # hours and temperatures for one year, from memory, the binary cache or the station file (in that order)
+        if year not in self.years and not self.readCache(year):
+            filename = self.stationFile(year)
+            print("Reading "+filename)
+            self.saveYear(year, *parseStationFile(filename, year, self.gapPolicy, self.maxGap))
+        return self.hourly(year)
+
+    def loadYears(self, years, status=None):
+        # load several years, parsing the station files not in the cache at the same time in a pool of processes;
+        # status, if given, is called with the name of each station file as it finishes loading
+        # The cache index is read once, and the entries of the years parsed added to it once they all are
+        index = None
+        parse = []
+        for year in years:
+            if year in self.years:
+                self.loads['memory'] += 1
+            elif index is None:
+                index = self.readIndex()
+            if year in self.years or self.readCache(year, index):
+                if status:
+                    status(self.stationFile(year))
+            else:
+                parse.append(year)
+
+        entries = {}
+        try:
+            self.parseYears(parse, entries, status)
+        finally:
+            # (also those parsed before the loading was stopped)
+            if len(entries) > 0:
+                try:
+                    self.updateIndex(entries)
+                except OSError as e:
+                    print("Unable to cache temperature data: %s" % e)
+
+    def parseYears(self, parse, entries, status=None):
+        # parse station files and save them in the cache, adding their index entries to entries (see loadYears)
+        if len(parse) > 1 and self.processes != 1:
+            # (imported here, as only needed when files are to be parsed)
+            from concurrent.futures import ProcessPoolExecutor, as_completed
+            from concurrent.futures.process import BrokenProcessPool
+            try:
+                pool = ProcessPoolExecutor(min(len(parse), self.processes or os.cpu_count() or 1))
+            except (OSError, NotImplementedError) as e:
+                print("Unable to start processes to read temperature data: %s" % e)
+                pool = None
+            if pool is not None:
+                try:
+                    futures = {}
+                    for year in parse:
+                        filename = self.stationFile(year)
+                        print("Reading "+filename)
+                        futures[pool.submit(parseStationFile, filename, year, self.gapPolicy, self.maxGap)] = year
+                    for future in as_completed(futures):
+                        year = futures[future]
+                        self.saveYear(year, *future.result(), entries=entries)
+                        if status:
+                            status(self.stationFile(year))
+                except BrokenProcessPool as e:
+                    print("Reading temperature data in this process: %s" % e)
+                finally:
+                    # (status may stop the loading, by raising an exception)
+                    pool.shutdown(wait=True, cancel_futures=True)
+
+        # those left, one at a time
+        for year in parse:
+            if year not in self.years:
+                filename = self.stationFile(year)
+                print("Reading "+filename)
+                self.saveYear(year, *parseStationFile(filename, year, self.gapPolicy, self.maxGap), entries=entries)
+                if status:
+                    status(self.stationFile(year))
+
+    def hourly(self, year):
+        # hours and (memory mapped) temperatures of a year loaded
+        first, temps = self.years[year]
+        return np.arange(first, first+len(temps), dtype=np.int64), temps
+
+    def degreeHours(self, status=None):
+        # heating and cooling degree-hours for each available year, {year: (valid hours, HDH, CDH)}, where valid hours
+        # excludes hours in gaps in the readings (missing, or runs of the same temperature longer than FILLED_HOURS)
+        # from the degree-hour file where it is up to date, otherwise from the data, for all such years in one pass
+        saved = self.readIndex(CACHE_DEGREE_HOURS)
+        stats = {}
+        missing = []
+        for year in self.availableYears():
+            entry = saved.get(os.path.basename(self.cacheFile(year)))
+            if entry is not None and entry['stamp']==self.sourceStamp(year):
+                stats[year] = (entry['valid'], entry['HDH'], entry['CDH'])
+            else:
+                missing.append(year)
+        if len(missing)==0:
+            return stats
+
+        self.loadYears(missing, status)
+        temps = [self.years[year][1] for year in missing]
+        yearIndex = np.repeat(np.arange(len(missing)), [len(T) for T in temps])
+        temp = np.concatenate(temps).astype(float)
+
+        # runs of the same temperature (not continuing from one year to the next)
+        change = np.ones(len(temp)+1, dtype=bool)
+        change[1:-1] = (temp[1:]!=temp[:-1]) | (yearIndex[1:]!=yearIndex[:-1])
+        runStarts = np.flatnonzero(change)
+        runLengths = np.diff(runStarts)
+        filled = np.repeat(runLengths > FILLED_HOURS, runLengths)
+
+        valid = np.bincount(yearIndex, weights=~filled & ~np.isnan(temp), minlength=len(missing))
+        temp = np.nan_to_num(temp, nan=DEGREE_HOUR_BASE)
+        HDH = np.bincount(yearIndex, weights=np.maximum(DEGREE_HOUR_BASE-temp, 0.), minlength=len(missing))
+        CDH = np.bincount(yearIndex, weights=np.maximum(temp-DEGREE_HOUR_BASE, 0.), minlength=len(missing))
+
+        for i, year in enumerate(missing):
+            stats[year] = (int(valid[i]), float(HDH[i]), float(CDH[i]))
+            saved[os.path.basename(self.cacheFile(year))] = {'stamp':self.sourceStamp(year), 'valid':stats[year][0], 
+                                                               'HDH':stats[year][1], 'CDH':stats[year][2]}
+        try:
+            os.makedirs(self.cacheDirectory, exist_ok=True)
+            self.writeIndex(saved, CACHE_DEGREE_HOURS)
+        except OSError as e:
+            print("Unable to cache degree-hours: %s" % e)
+        return stats
+
+    def typicalYears(self, status=None):
+        # the (median heating degree-hour, highest heating, median cooling, highest cooling) years among the years with
+        # readings for COMPLETE_YEAR of their hours, or None if there are none
+        stats = self.degreeHours(status)
+        years = sorted(year for year in stats if stats[year][0] >= COMPLETE_YEAR*8760)
+        if len(years)==0:
+            return None
+
+        def median(i):
+            ranked = sorted(years, key=lambda year: stats[year][i])
+            return ranked[(len(ranked)-1)//2]
+        def highest(i):
+            return max(years, key=lambda year: stats[year][i])
+        return median(1), highest(1), median(2), highest(2)
+
+    def load(self, yearStart, yearEnd, status=None, dtype=None):
+        # hourly times (datetime64[h]) and outdoor temperatures (float32, or dtype) for the years yearStart-yearEnd
+        # status, if given, is called with the name of each station file as it is loaded (see loadYears)
+        # A single float32 year is returned as loaded (memory mapped); otherwise the temperatures are built in one pass
+        # from the years loaded, converted to dtype as they are copied
+        self.loadYears(range(yearStart, yearEnd+1), status)
+        hours = []
+        temps = []
+        for year in range(yearStart, yearEnd+1):
+            h, T = self.hourly(year)
+            hours.append(h)
+            temps.append(T)
+
+        if len(hours)==1 and (dtype is None or temps[0].dtype==dtype):
+            return hours[0].view('datetime64[h]'), temps[0]
+        return np.concatenate(hours).view('datetime64[h]'), np.concatenate(temps, dtype=dtype)
+
+class ClimateLibrary :
+    """The weather stations with data in a directory, each a ClimateStore made when first used"""
+    def __init__(self, directory, gapPolicy='fill', maxGap=None) :
+        self.directory = directory
+        self.gapPolicy = gapPolicy
+        self.maxGap = maxGap
+        self.stores = {}        # ClimateStore for each station used so far
+        self.index = None       # from stationIndex
+
+    def stationIndex(self):
+        # {station id: {'name', 'lat', 'lon', 'years'}} for the stations in the index file or with station files
+        # (name, lat and lon are None where not known, years is a sorted list of the years with a station file)
+        if self.index is not None:
+            return self.index
+
+        try:
+            with open(os.path.join(self.directory, STATION_INDEX),'r') as input:
+                listed = json.load(input)
+        except (OSError, ValueError):
+            listed = {}
+
+        index = {}
+        for id, entry in listed.items():
+            index[id] = {'name':entry.get('name'), 'lat':entry.get('lat'), 'lon':entry.get('lon'), 'years':[]}
+        for name in os.listdir(self.directory):
+            id, dash, year = name[0:-4].rpartition('-')
+            if name.endswith('.txt') and dash and year.isdigit():
+                index.setdefault(id, {'name':None, 'lat':None, 'lon':None, 'years':[]})['years'].append(int(year))
+        for entry in index.values():
+            entry['years'].sort()
+
+        self.index = index
+        return index
+
+    def station(self, id=DEFAULT_STATION):
+        # the ClimateStore for a station
+        if id not in self.stores:
+            if id not in self.stationIndex():
+                raise ValueError("no climate data for station "+id)
+            self.stores[id] = ClimateStore(self.directory, id, self.gapPolicy, self.maxGap)
+        return self.stores[id]
+
+    def nearestStation(self, lat, lon):
+        # id of the station with data nearest a location (None if no station with data has a location)
+        nearest = None
+        for id, entry in self.stationIndex().items():
+            if len(entry['years'])==0 or entry['lat'] is None or entry['lon'] is None:
+                continue
+            d = distance(lat, lon, entry['lat'], entry['lon'])
+            if nearest is None or d < nearest[0]:
+                nearest = (d, id)
+        return None if nearest is None else nearest[1]
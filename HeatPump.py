@@ -1,6 +1,8 @@
 
 # 7/19/17 BHN:  Updated to ColdClimateAir=SourceHeatPumpSpecificationListing 7.14.17
 
+import numpy as np
+
 class HeatPump :
     """Data and methods for calculation of heat pump parameters"""
     def __init__(self, Manufacturer, Brand, ModelName, AHRICertNumber, OutdoorUnit,IndoorUnits,AHRIType,HSPFregIV,SEER,EER_95,CoolingCapacity, EnergyStar, DuctedDuctless,Zones,DuctlessIndoorType) :
@@ -67,78 +69,58 @@ class HeatPump :
         aMaxCOP = COPMax[2] - 5.*bMaxCOP
         a_Max.append([aMaxCOP,aMaxCAP])
 
-    def MaxCapacity(self,temp):
+    def setPerformanceData(self, tData, CAPMin, CAPMax, COPMin, COPMax):
+        # temperatures (decreasing: 47, 17, 5 and optionally the minimum operating temperature) and 
+        # the capacity and COP at minimum and maximum capacity for each of them
+        self.tData = tData
+        self.CAPMin = CAPMin
+        self.CAPMax = CAPMax
+        self.COPMin = COPMin
+        self.COPMax = COPMax
+        self.buildTables()
+
+    def buildTables(self):
+        # interpolation tables, with the temperatures in increasing order as needed by np.searchsorted
+        # rows of perfTable: max capacity, min capacity, COP at min capacity, COP at max capacity
+        self.tTable = np.array(self.tData[::-1], dtype=float)
+        self.perfTable = np.array([self.CAPMax[::-1], self.CAPMin[::-1], self.COPMin[::-1], self.COPMax[::-1]], dtype=float)
+
+    def performance(self, temp):
+        # max capacity, min capacity, COP at min capacity and COP at max capacity at outdoor temperature temp
+        # (a number or an array of temperatures), by linear interpolation between the nearest reported points
+        # warmer than the 47 deg point, the 47 deg values are used
+        # colder than the coldest point specified, the values at that point are used
+        # question as to how heat pump will perform here - assume it doesn't function at that temperature
+        if getattr(self, 'perfTable', None) is None or len(self.tTable) != len(self.tData):
+            self.buildTables()
+        tTable = self.tTable
+        perfTable = self.perfTable
+
+        scalar = np.ndim(temp)==0
+        temp = np.atleast_1d(np.asarray(temp, dtype=float))
+
+        # interpolate from the warmer point of the interval tTable[i] < temp <= tTable[i+1], as the original scan did
+        i = np.clip(np.searchsorted(tTable, temp, side='left') - 1, 0, len(tTable)-2)
+        frac = (temp - tTable[i+1]) / (tTable[i] - tTable[i+1])
+        values = perfTable[:,i+1] + frac * (perfTable[:,i] - perfTable[:,i+1])
+
+        warmer = temp > tTable[-1]
+        values[:,warmer] = perfTable[:,-1:]
+        colder = temp <= tTable[0]
+        values[:,colder] = perfTable[:,:1]
 
-        if temp>self.tData[0]:
-            # warmer than the 47 deg point
-            capacity_Max = self.CAPMax[0]
-        elif temp <= self.tData[-1]:
-            # colder than the coldest point specified
-            # question as to how heat pump will perform here - assume it doesn't function at that temperature
-            capacity_Max = self.CAPMax[-1]
-        else:
-            for i in range(len(self.tData)-1):
-                if temp > self.tData[i+1] and temp<= self.tData[i] :
-                    # linear interpolation between the nearest reported points
-                    frac = (temp-self.tData[i])/float(self.tData[i+1] - self.tData[i])
-                    capacity_Max = self.CAPMax[i] + frac * (self.CAPMax[i+1] - self.CAPMax[i])
-                    break
-        return capacity_Max
+        if scalar:
+            return tuple(float(v) for v in values[:,0])
+        return values[0], values[1], values[2], values[3]
+
+    def MaxCapacity(self,temp):
+        return self.performance(temp)[0]
         
     def MinCapacity(self,temp):
-
-        if temp>self.tData[0]:
-            # warmer than the 47 deg point
-            capacity_Min = self.CAPMin[0]
-        elif temp <= self.tData[-1]:
-            # colder than the coldest point specified
-            # question as to how heat pump will perform here - assume it doesn't function at that temperature
-            capacity_Min = self.CAPMin[-1]
-        else:
-            for i in range(len(self.tData)-1):
-                if temp > self.tData[i+1] and temp<= self.tData[i] :
-                    # linear interpolation between the nearest reported points
-                    frac = (temp-self.tData[i])/float(self.tData[i+1] - self.tData[i])
-                    capacity_Min = self.CAPMin[i] + frac * (self.CAPMin[i+1] - self.CAPMin[i])
-                    break
-        return capacity_Min
+        return self.performance(temp)[1]
          
     def COPatMinCapacity(self,temp):
-
-        if temp>self.tData[0]:
-            # warmer than the 47 deg point
-            COP_Min = self.COPMin[0]
-        elif temp <= self.tData[-1]:
-            # colder than the coldest point specified
-            # question as to how heat pump will perform here - assume it doesn't function at that temperature
-            COP_Min = self.COPMin[-1]
-        else:
-            for i in range(len(self.tData)-1):
-                if temp > self.tData[i+1] and temp<= self.tData[i] :
-                    # linear interpolation between the nearest reported points
-                    frac = (temp-self.tData[i])/float(self.tData[i+1] - self.tData[i])
-                    COP_Min = self.COPMin[i] + frac * (self.COPMin[i+1] - self.COPMin[i]) 
-                    break
-        return COP_Min
+        return self.performance(temp)[2]
         
     def COPatMaxCapacity(self,temp):
-
-        if temp>self.tData[0]:
-            # warmer than the 47 deg point
-            COP_Max = self.COPMax[0]
-        elif temp <= self.tData[-1]:
-            # colder than the coldest point specified
-            # question as to how heat pump will perform here - assume it doesn't function at that temperature
-            COP_Max = self.COPMax[-1]
-        else:
-            for i in range(len(self.tData)-1):
-                if temp > self.tData[i+1] and temp<= self.tData[i] :
-                    # linear interpolation between the nearest reported points
-                    frac = (temp-self.tData[i])/float(self.tData[i+1] - self.tData[i])
-                    COP_Max = self.COPMax[i] + frac * (self.COPMax[i+1] - self.COPMax[i])
-                    break
-        return COP_Max
-
-
-                    
-            
+        return self.performance(temp)[3]
@@ -33,19 +33,10 @@
 # dual fuel system
 # heat pump cooling
 
-# matplotlib figure plotting library
-import matplotlib
-matplotlib.use("TkAgg")
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg,NavigationToolbar2TkAgg
-#from matplotlib.figure import Figure
-import matplotlib.animation as animation
-from matplotlib import style
-from matplotlib import pyplot as plt
-
-import matplotlib.dates as mdates
-import matplotlib.ticker as mticker
-
 import numpy as np
+import queue
+import threading
+import multiprocessing
 
 # tkinter user interface library
 import tkinter as tk
@@ -63,51 +54,93 @@ HUGE_FONT = ("Verdana",36)
 LARGE_FONT = ("Verdana",20)
 NORM_FONT = ("Helvetica",16)
 SMALL_FONT = ("Helvetica",13)
-style.use("ggplot")
-
-#f = Figure(figsize=(10,6), dpi=100)
-#a = f.add_subplot(111)
-f = plt.figure()
-a = plt.subplot2grid((3,3), (0,0), rowspan=3, colspan=3)
-
-#f1 = Figure(figsize=(3,2), dpi=100)
-#a1 = f1.add_subplot(111)
-f1 = plt.figure()
-a1 = plt.subplot2grid((9,3), (0,0), rowspan = 4, colspan = 3)
-a1.set_ylabel('COP')
-a1.set_ylim(0.,5.)
-a1.set_autoscalex_on(False)
-a1.set_autoscaley_on(False)
-a1.set_xlim(-20.,60.)
+
+# matplotlib figure plotting library, imported when the first figure is made (see loadMatplotlib)
+matplotlib = plt = FigureCanvasTkAgg = NavigationToolbar2TkAgg = None
+
+def loadMatplotlib():
+    # importing matplotlib takes most of the start up time, so it waits until a page with a figure is shown
+    global matplotlib, plt, FigureCanvasTkAgg, NavigationToolbar2TkAgg
+    if plt is not None:
+        return
+    import matplotlib
+    matplotlib.use("TkAgg")
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg,NavigationToolbar2TkAgg
+    #from matplotlib.figure import Figure
+    from matplotlib import style
+    from matplotlib import pyplot as plt
+    style.use("ggplot")
+
+# the figures, each made when first used
+f = a = None            # hourly heat pump performance (Graph page)
+f1 = a1 = a2 = None     # COP and capacity of the selected heat pump (heat pump selection page)
+f3 = a3 = None          # fuel consumption (fuel delivery page)
+f4 = a4 = None          # costs over the years (Economics page)
 firstPlot = True
 
-a2 = plt.subplot2grid((9,3), (5,0), rowspan = 4, colspan = 3, sharex=a1)
-a2.set_ylabel('Capacity')
-a2.set_xlabel('Outdoor Temp (deg F)')
-a2.set_ylim(0.,50000.)
-a2.set_autoscalex_on(False)
-a2.set_autoscaley_on(False)
-plt.grid(True)
-
-f3 = plt.figure()
-a3 = plt.subplot2grid((3,3), (0,0), rowspan = 4, colspan = 3)
-a3.set_ylabel('Quantity')
-a3.set_xlabel('Date')
-a3.set_ylim(0.,50000.)
-a3.set_autoscalex_on(True)
-a3.set_autoscaley_on(True)
-plt.grid(True)
-
-f4 = plt.figure()
-a4 = plt.subplot2grid((2,2), (0,0), rowspan = 3, colspan = 3)
-a4.set_ylabel('Cost')
-a4.set_xlabel('Years after investment')
-a4.set_ylim(0.,50000.)
-a4.set_autoscalex_on(True)
-a4.set_autoscaley_on(True)
-plt.grid(True)
-
-hpa = HeatPumpAnalysis()
+def performanceFigure():
+    global f, a
+    if f is None:
+        loadMatplotlib()
+#        f = Figure(figsize=(10,6), dpi=100)
+#        a = f.add_subplot(111)
+        f = plt.figure()
+        a = plt.subplot2grid((3,3), (0,0), rowspan=3, colspan=3)
+    return f
+
+def heatPumpFigure():
+    global f1, a1, a2
+    if f1 is None:
+        loadMatplotlib()
+#        f1 = Figure(figsize=(3,2), dpi=100)
+#        a1 = f1.add_subplot(111)
+        f1 = plt.figure()
+        a1 = plt.subplot2grid((9,3), (0,0), rowspan = 4, colspan = 3)
+        a1.set_ylabel('COP')
+        a1.set_ylim(0.,5.)
+        a1.set_autoscalex_on(False)
+        a1.set_autoscaley_on(False)
+        a1.set_xlim(-20.,60.)
+
+        a2 = plt.subplot2grid((9,3), (5,0), rowspan = 4, colspan = 3, sharex=a1)
+        a2.set_ylabel('Capacity')
+        a2.set_xlabel('Outdoor Temp (deg F)')
+        a2.set_ylim(0.,50000.)
+        a2.set_autoscalex_on(False)
+        a2.set_autoscaley_on(False)
+        plt.grid(True)
+    return f1
+
+def deliveryFigure():
+    global f3, a3
+    if f3 is None:
+        loadMatplotlib()
+        f3 = plt.figure()
+        a3 = plt.subplot2grid((3,3), (0,0), rowspan = 4, colspan = 3)
+        a3.set_ylabel('Quantity')
+        a3.set_xlabel('Date')
+        a3.set_ylim(0.,50000.)
+        a3.set_autoscalex_on(True)
+        a3.set_autoscaley_on(True)
+        plt.grid(True)
+    return f3
+
+def costFigure():
+    global f4, a4
+    if f4 is None:
+        loadMatplotlib()
+        f4 = plt.figure()
+        a4 = plt.subplot2grid((2,2), (0,0), rowspan = 3, colspan = 3)
+        a4.set_ylabel('Cost')
+        a4.set_xlabel('Years after investment')
+        a4.set_ylim(0.,50000.)
+        a4.set_autoscalex_on(True)
+        a4.set_autoscaley_on(True)
+        plt.grid(True)
+    return f4
+
+# the heat pump catalog and the default fuel deliveries are loaded by the pages using them
+hpa = HeatPumpAnalysis(loadDeliveries=False)
 
 def quit():
     exit(0)
@@ -122,23 +155,26 @@ def popupmsg(title, msg):
     B1.pack()
     popup.mainloop()    
 
-def animate(i):
+def animate(analysis):
+    # graph the hourly series of an analysis (the copy of hpa analyzed in the worker thread, which nothing changes after)
 
-    if len(hpa.HPChoice)>0 :
-        hp = hpa.HPChoice[0]
+    if len(analysis.HPChoice)>0 :
+        hp = analysis.HPChoice[0]
     else:
         return
             
-    if hpa.updateGraph :
+    if analysis.updateGraph :
     
 #        a = plt.subplot2grid((6,4), (0,0), rowspan = 5, colspan = 4)
 #        a2 = plt.subplot2grid((6,4), (5,0), rowspan = 1, colspan = 4, sharex = a)
 
+        performanceFigure()
         a.clear()
-        a.plot_date(hpa.timeArray,hpa.Q_required, "g", label = "Total required heat")
-        a.plot_date(hpa.timeArray,hpa.supplemental_Heat, "r", label = "Supplemental needed")
-        a.plot_date(hpa.timeArray,hpa.capacity_Max, "b", label = "Maximum Capacity")
-        a.plot_date(hpa.timeArray,hpa.QC_required, "y", label = "Cooling required")
+        times = analysis.timeArray.astype('datetime64[h]').astype(object)     # datetimes, from the hours of the analysis
+        a.plot_date(times,analysis.Q_required, "g", label = "Total required heat")
+        a.plot_date(times,analysis.supplemental_Heat, "r", label = "Supplemental needed")
+        a.plot_date(times,analysis.capacity_Max, "b", label = "Maximum Capacity")
+        a.plot_date(times,analysis.QC_required, "y", label = "Cooling required")
     
         a.legend(bbox_to_anchor=(0,0.92,1,.102),loc=3, ncol=4, borderaxespad=0)
         
@@ -147,8 +183,35 @@ def animate(i):
         a.set_title(title)
         f.canvas.draw()
         
-        hpa.updateGraph = False
+        analysis.updateGraph = False
         
+class AnalysisStatus:
+    """Progress of an analysis running in a worker thread"""
+    # the analysis reports progress by calling this, with the stage and fraction done (see HeatPumpAnalysis.showStatus);
+    # messages are posted to a queue which the Tk loop polls, and the analysis is stopped at the next one once cancelled
+    def __init__(self):
+        self.messages = queue.Queue()
+        self.cancelled = threading.Event()
+
+    def __call__(self, stage, fraction=None):
+        if self.cancelled.is_set():
+            raise AnalysisCancelled()
+        self.messages.put(('status', (stage, fraction)))
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def run(self, analysis):
+        # call analysis() in a worker thread, posting its result (or failure) when done
+        def work():
+            try:
+                self.messages.put(('done', analysis()))
+            except AnalysisCancelled:
+                self.messages.put(('cancelled', None))
+            except Exception as e:
+                self.messages.put(('error', e))
+        threading.Thread(target=work, daemon=True).start()
+
 class HeatPumpPerformanceApp(tk.Tk):
 
     def __init__(self,*args, **kwargs):
@@ -276,6 +339,7 @@ def UpdateDeliveryGraph(self):
             ma1.append(hpa.WaterHeatMonthlyUsage)    
             ma1.append(hpa.WaterHeatMonthlyUsage)
     
+        deliveryFigure()
         a3.clear()
         a3.plot_date(tArray,fuel_required, "g", label = "Total monthly fuel consumption")   
 
@@ -334,6 +398,7 @@ class HomePage(tk.Frame) :
         self.controller = controller
         
     def LayoutFrame(self):
+        hpa.loadDefaultDeliveries()     # unless a deliveries file was loaded already
         
         label=ttk.Label(self,text="Home Page",font=LARGE_FONT)        
         label.pack(pady=10,padx=10)
@@ -360,20 +425,76 @@ class HomePage(tk.Frame) :
                     command = lambda: self.controller.show_frame(SupplementalHeatPage))
         button3s.pack(pady=ys)
 
+        # the analysis runs in a worker thread, so that the window stays responsive; its progress messages
+        # are picked up every 100 ms, and the Cancel button stops it at the next one
+        # It analyzes a copy of hpa, whose results are taken back when it is done; meanwhile the pages which change
+        # the inputs are not opened
         def doAnalysis():
-            msg = hpa.doHeatPumpAnalysis(statusBar)
-            if len(msg) <100:
-                popupmsg("Heat Pump Analysis Tool", msg)
+            self.analysis = AnalysisStatus()
+            work = hpa.copy()
+            buttonDo.config(state=DISABLED)
+            buttonCancel.config(state=NORMAL)
+            for button in editButtons:
+                button.config(state=DISABLED)
+            progress.config(mode='indeterminate', value=0)
+            progress.start()
+            self.analysis.run(lambda: (work.doHeatPumpAnalysis(self.analysis), work))
+            self.after(100, pollAnalysis)
+
+        def cancelAnalysis():
+            self.analysis.cancel()
+            statusBar.config(text="Cancelling analysis")
+
+        def pollAnalysis():
+            while True:
+                try:
+                    event, value = self.analysis.messages.get_nowait()
+                except queue.Empty:
+                    self.after(100, pollAnalysis)
+                    return
+                if event == 'status':
+                    stage, fraction = value
+                    statusBar.config(text=stage)
+                    if fraction is not None:
+                        # the progress bar shows the fraction done, once it is known
+                        progress.stop()
+                        progress.config(mode='determinate', value=100*fraction)
+                else:
+                    break
+
+            progress.stop()
+            buttonDo.config(state=NORMAL)
+            buttonCancel.config(state=DISABLED)
+            for button in editButtons:
+                button.config(state=NORMAL)
+            if event == 'cancelled':
+                statusBar.config(text="Analysis cancelled")
+            elif event == 'error':
+                statusBar.config(text="Analysis failed")
+                popupmsg("Heat Pump Analysis Tool", "Analysis failed: "+str(value))
+            else:
+                statusBar.config(text="Status: idle")
+                msg, work = value
+                if isinstance(msg, str):
+                    # nothing to analyze (otherwise AnalysisResults, shown as the text report)
+                    popupmsg("Heat Pump Analysis Tool", msg)
                 
-            text1.insert(END,msg)    
-            if hpa.updateGraph:
-                animate(0)
+                text1.insert(END,str(msg))    
+                if work.updateGraph:
+                    animate(work)
+                hpa.takeResults(work)
                 
         button4 = ttk.Button(self,width=26,text="Fuel Options",command = lambda:self.controller.show_frame(FuelOptionsPage) )
         button4.pack(pady=ys)
 
-        button4 = ttk.Button(self,width=26,text="Do Analysis",command = lambda: doAnalysis() )
-        button4.pack(pady=ys)
+        buttonDo = ttk.Button(self,width=26,text="Do Analysis",command = lambda: doAnalysis() )
+        buttonDo.pack(pady=ys)
+
+        buttonCancel = ttk.Button(self,width=26,text="Cancel Analysis",state=DISABLED,command = lambda: cancelAnalysis() )
+        buttonCancel.pack(pady=ys)
+
+        progress = ttk.Progressbar(self,length=200,mode='indeterminate')
+        progress.pack(pady=ys)
 
         button5 = ttk.Button(self,width=26,text="Show Graph",
                     command = lambda: self.controller.show_frame(GraphPage))
@@ -383,6 +504,8 @@ class HomePage(tk.Frame) :
                     command = lambda: self.controller.show_frame(EconomicsPage))
         button6.pack(pady=ys)
         
+        editButtons = [button1, button2, button3, button3s, button4, button6]   # (see doAnalysis)
+
         buttonQ = ttk.Button(self,width=26,text = "Quit", command = quit)
         buttonQ.pack(pady=ys)
 
@@ -555,7 +678,7 @@ class FuelDeliveryPage(tk.Frame):
         button8 = ttk.Button(self,text="Edit",command = lambda: EditHeaderInfo())
         button8.grid(row=2,column=2)
  
-        canvas = FigureCanvasTkAgg(f3,self)
+        canvas = FigureCanvasTkAgg(deliveryFigure(),self)
         canvas.show()
         canvas.get_tk_widget().grid(column=3, columnspan=3, row=4, rowspan=4)  #fill=tk.BOTH,,pady=10
        
@@ -863,6 +986,7 @@ def selHeatPump(H,info):
     else:
         hpa.HPChoice[0] = heatPump
         
+    heatPumpFigure()
     a1.clear()
             
     if firstPlot:
@@ -933,6 +1057,8 @@ class SelectHeatPumpPage(tk.Frame):
             
     def LayoutFrame(self):
         HPFilter = ['Ductless','Ducted','All']
+        if hpa.catalog is None:
+            hpa.loadHeatPumps()
 
         HPListIndex2ID = []
         
@@ -952,17 +1078,15 @@ class SelectHeatPumpPage(tk.Frame):
             lb.delete(0,lb.size())
             filter = filterVar    # the string variable
             filter = HPFilter[filter]
-            h = 0
-            for hp in hpa.HPList:
-                ductless = (hp.DuctedDuctless == 'Ductless')
-                if ( (ductless and (filter=='Ductless' or filter=='All')) or ((not ductless) and (filter != 'Ductless'))) :
-                    insertText = hp.Brand + " Model " + hp.OutdoorUnit + " " + hp.DuctedDuctless
-#                    insertText = hp.Manufacturer + " Model " + hp.OutdoorUnit + " " + hp.DuctedDuctless
-                    if hp.DuctedDuctless == 'Ductless': insertText+='-' + hp.Zones
-                        
-                    lb.insert(h,insertText)
-                    HPListIndex2ID.append(h)
-                h += 1
+            ductless = None if filter=='All' else (filter=='Ductless')
+            for h in hpa.catalog.select(ductless=ductless).tolist():
+                hp = hpa.HPList[h]
+                insertText = hp.Brand + " Model " + hp.OutdoorUnit + " " + hp.DuctedDuctless
+#                insertText = hp.Manufacturer + " Model " + hp.OutdoorUnit + " " + hp.DuctedDuctless
+                if hp.DuctedDuctless == 'Ductless': insertText+='-' + hp.Zones
+                    
+                lb.insert(END,insertText)
+                HPListIndex2ID.append(h)
             print("Heat pump list filled")
 
         rb1 = tk.Radiobutton(self, text="Ductless", variable=HPType, value=0, command=lambda: FillHPListBox(lb,0))
@@ -977,7 +1101,7 @@ class SelectHeatPumpPage(tk.Frame):
         lb.grid(row=2,column=0, rowspan=1,columnspan=3,sticky=(N))
         lb.activate(0)
         
-        canvas = FigureCanvasTkAgg(f1,self)
+        canvas = FigureCanvasTkAgg(heatPumpFigure(),self)
         canvas.show()
         canvas.get_tk_widget().grid(column=3, columnspan=3, row=1, rowspan=4)  #fill=tk.BOTH,,pady=10
 
@@ -1159,7 +1283,7 @@ class GraphPage(tk.Frame):
                     command = lambda: self.controller.show_frame(HomePage))
         button1.pack()
         
-        canvas = FigureCanvasTkAgg(f,self)
+        canvas = FigureCanvasTkAgg(performanceFigure(),self)
         canvas.show()
         canvas.get_tk_widget().pack(side=tk.TOP,fill=tk.BOTH,expand=True)
         
@@ -1253,6 +1377,7 @@ class EconomicsPage(tk.Frame):
         self.textPaybackData.config(text=textPD)
         self.textPaybackData.update()
         
+        costFigure()
         a4.clear()
         a4.plot(Years,HeatPumpCostByYear, "g", label = "Heat Pump Cost")
         a4.plot(Years,AlternativeCostByYear, "r", label = "Alternative System Cost")
@@ -1579,7 +1704,7 @@ class EconomicsPage(tk.Frame):
 
         self.UpdatePaybackData()
         
-        canvas = FigureCanvasTkAgg(f4,self)
+        canvas = FigureCanvasTkAgg(costFigure(),self)
         canvas.show()
         canvas.get_tk_widget().grid(column=3, columnspan=3, row=20)  #fill=tk.BOTH,,pady=10
         
@@ -1587,11 +1712,13 @@ class EconomicsPage(tk.Frame):
                     command = lambda: self.controller.show_frame(HomePage))
         button10.grid(row=0, column=4)
     
-hpa.loadHeatPumps()
-
 # main routine 
+# (not run when the module is imported by the processes reading the climate data)
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
 
-app = HeatPumpPerformanceApp()
-#ani = animation.FuncAnimation(f,animate, interval=1000)
-app.mainloop()
-app.destroy()
+    app = HeatPumpPerformanceApp()
+    #ani = animation.FuncAnimation(f,animate, interval=1000)
+    app.mainloop()
+    app.destroy()
@@ -37,14 +37,33 @@
 # to do:
 # dehumidifier usage
 import os
+import copy
+import itertools
+import contextlib
+from collections import OrderedDict
 
 from HeatPump import *          # new heat pump class
+from ClimateData import ClimateLibrary, DEFAULT_STATION
+from HeatPumpCatalog import HeatPumpCatalog
+from Instrumentation import Instrumentation
+from AnalysisResults import AnalysisResults, YEAR_COLUMNS, HOURLY_SERIES, HOURLY_CHUNK, writeHourly
 
-from datetime import datetime, date, time
-from pylab import *
+import datetime
+from datetime import date
+import numpy as np
 
 #HEAT_PUMP_FILE_NAME = 'Cold Climate Air-Source Heat Pump Listing.txt'
 HEAT_PUMP_FILE_NAME = 'ColdClimateAir-SourceHeatPumpSpecificationListing-Updated 7.14.17_1.txt'
+# the listings making up the heat pump catalog, the newest first (it gives the heat pump for a certificate number
+# in more than one)
+HEAT_PUMP_LISTINGS = [HEAT_PUMP_FILE_NAME, 'Cold Climate Air-Source Heat Pump Listing-new.txt',
+                      'Cold Climate Air-Source Heat Pump Listing.csv', 'Cold Climate Air-Source Heat Pump Listing.txt']
+
+# the data directory, with the heat pump listings, 'Climate Data', 'Residential Profiles' and 'Output Data'
+# (see resolveDataRoot)
+DATA_ROOT_VARIABLE = 'HPAT_DATA'
+DATA_ROOT_MARKER = 'Climate Data'
+_dataRoots = {}     # resolved data directories, by the directory given and the environment variable
 
 # Heating system types
 
@@ -75,12 +94,75 @@ EFFICIENCY_HVAC_OTHER = 1.0
 ENERGY_CONTENT_OTHER = 1
 KGCO2_PER_UNIT_OTHER = 0
 
+# certain years of note since 1993 - the years analyzed if the climate data has no complete years to choose from
+# (see typicalYears)
+AVERAGE_HDD_YEAR = 2008
+AVERAGE_CDD_YEAR = 2003
+HIGHEST_HDD_YEAR = 2003
+HIGHEST_CDD_YEAR = 2010
+
+# The temperature series last loaded by LoadTempDataRaw are kept (SERIES_CACHE_SIZE of them), so that switching
+# between the analysis period and the average and coldest years does not rebuild them
+SERIES_ATTRIBUTES = ('t_Hours','T_Outdoor','t_DayIndex','t_TempValues','t_TempIndex',
+                     't_SeasonKey','t_MaskKey','t_HeatingYear','t_InSeason','t_Heating','t_Cooling')
+SERIES_CACHE_SIZE = 4
+
+# the hourly series of an analysis (see HOURLY_SERIES) are kept in this type, and their hours (timeArray) as int64
+# hours since 1970-01-01 (local time)
+HOURLY_DTYPE = np.float32
+
+# results of the single year (average and coldest) simulations, kept for the most recently used inputs
+YEAR_CACHE_SIZE = 16
+YEAR_RESULTS = ('KWhByYear','SuppUnitsByYear','SuppUsesByYear','BLAC_KWhByYear','HPAC_KWhByYear','totalRequiredHeating','totalRequiredCooling',
+                'timeArray1','Q_required1','QC_required1','capacity_Max1','capacity_Min1','electric_Required1','supplemental_Heat1','COP_Ave1')
+
+# the largest relative difference in the yearly results of the bin method (useBinMethod) from the hourly simulation
+# accepted by checkBinMethod: supplemental heat agrees to rounding, electricity to about 1e-3 (the COP interpolated
+# at the mean requirement of a bin)
+BIN_TOLERANCE = 2e-3
+
+# the stage timed when the analysis is not instrumented (see HeatPumpAnalysis.span)
+NO_SPAN = contextlib.nullcontext()
+
+# measures by which rankHeatPumps can order heat pump systems
+RANK_BY = {'cost':'Cost', 'supplemental':'SuppFraction', 'co2':'KgCO2'}
+
+def resolveDataRoot(directory=None):
+    # the data directory, ending with a separator: the directory given, otherwise the one named by the HPAT_DATA
+    # environment variable, otherwise the directory of this program or else the current directory, whichever has
+    # the climate data in it
+    key = (directory, os.environ.get(DATA_ROOT_VARIABLE))
+    if key not in _dataRoots:
+        if directory or key[1]:
+            candidates = [directory or key[1]]
+        else:
+            candidates = [os.path.dirname(os.path.abspath(__file__)), os.getcwd()]
+        for candidate in candidates:
+            if os.path.isdir(os.path.join(candidate, DATA_ROOT_MARKER)):
+                _dataRoots[key] = os.path.join(os.path.abspath(candidate), '')
+                break
+        else:
+            raise FileNotFoundError("No '%s' in %s (set %s to the data directory)" % 
+                                    (DATA_ROOT_MARKER, ' or '.join(candidates), DATA_ROOT_VARIABLE))
+    return _dataRoots[key]
+
+# Progress of an analysis is reported through its status argument: None, or a function status(stage, fraction)
+# called with a description of each stage and the fraction of the analysis done by then (0 to 1, or None where it
+# isn't known), which may raise AnalysisCancelled to stop the analysis.  A Tk label, or any object with
+# config(text=) and update() methods, may be given instead (see showStatus).
+
+class AnalysisCancelled(Exception):
+    """Raised by a status object's update() to stop an analysis in progress"""
+
 class HeatPumpAnalysis :    
     """Data and methods for calculation of heat pump parameters"""
-    def __init__(self) :
+    def __init__(self, loadDeliveries=True, dataRoot=None) :
+        # loadDeliveries: load the default fuel deliveries now (otherwise see loadDefaultDeliveries)
+        # dataRoot: the data directory (see resolveDataRoot)
         # Heat pump parameters
 
         self.HPList = []         # list of all defined heat pumps
+        self.catalog = None      # HeatPumpCatalog the list is from
         self.HPChoice = []       # new: list of chosen heat pumps (objects from HPList, can be repeated)
 
         self.HEAT_NAME_OIL = "Fuel Oil"
@@ -144,7 +226,7 @@ class HeatPumpAnalysis :
         self.BLACAverageUnits = 0
         self.SuppAverageUnits = 0
 
-        self.T_Outdoor = [] # (1 To SITE_DATA_MAX) As Single ' outdoor temperature
+        self.T_Outdoor = np.zeros(0)    # outdoor temperature for each hour of t_Hours
         self.WinterHPSetPoint = 65       # formerly T_Indoor : indoor temperaure as provided by the user
         self.SummerHPSetPoint = 78
         self.WinterBLSetPoint = self.WinterHPSetPoint
@@ -153,7 +235,12 @@ class HeatPumpAnalysis :
         self.BaselineSEER = 0
 
         # times at which the temperature data was taken, this includes date and time
-        self.t_Data = []    # (1 To SITE_DATA_MAX) As Date 
+        self.t_Hours = np.zeros(0, dtype='datetime64[h]')   # each hour of the series loaded
+        self.t_DayIndex = {}                                # first and last index of the hours on each date
+        self.t_SeasonKey = None     # heating season dates and set points for which the seasonMasks arrays were made
+        self.t_MaskKey = None
+        self.t_Years = None         # station, first and last year of the loaded series
+        self.t_Series = {}          # other series loaded, by years (see SERIES_ATTRIBUTES)
         self.t_Start = 0
         self.t_End = 0
 
@@ -173,16 +260,17 @@ class HeatPumpAnalysis :
         self.approx_Resistance = [] # (1 To PURCHASES_MAX, 1 To 2) As Double 
         self.average_Resistance = -1.0
 
-        # arrays indexed by time (calculated from temperature vs time data)
-        self.timeArray = []
-        self.Q_required = []         # Double # based on resistance and outdoor temperatures only
-        self.QC_required = []         # Double # based on resistance and outdoor temperatures only
-        self.electric_Required = []  # Min consumption, Approximate requirement, Max consumption (for each heat pump)
-
-        self.capacity_Max = []       # maximum capacity of each heat pump in the heating period
-        self.capacity_Min = []       # minimum capacity of each heat pump in the heating period
-        self.supplemental_Heat = []  # additional heat required to meet heating requirements per hour
-        self.COP_Ave = []            #  
+        # arrays indexed by time (calculated from temperature vs time data), HOURLY_DTYPE (see heatPumpPerformance)
+        self.timeArray = np.zeros(0, dtype=np.int64)    # hour since 1970-01-01 (local time)
+        self.Q_required = np.zeros(0, dtype=HOURLY_DTYPE)        # Double # based on resistance and outdoor temperatures only
+        self.QC_required = np.zeros(0, dtype=HOURLY_DTYPE)       # Double # based on resistance and outdoor temperatures only
+        self.electric_Required = np.zeros(0, dtype=HOURLY_DTYPE) # Min consumption, Approximate requirement, Max consumption (for each heat pump)
+
+        self.capacity_Max = np.zeros(0, dtype=HOURLY_DTYPE)      # maximum capacity of each heat pump in the heating period
+        self.capacity_Min = np.zeros(0, dtype=HOURLY_DTYPE)      # minimum capacity of each heat pump in the heating period
+        self.supplemental_Heat = np.zeros(0, dtype=HOURLY_DTYPE) # additional heat required to meet heating requirements per hour
+        self.COP_Ave = np.zeros(0, dtype=HOURLY_DTYPE)           #  
+        self.hourlyBuffer = None    # the array holding the series above, a row for each (reused for as many hours)
         self.baselineAC_pwr = []
         self.heatpumpAC_pwr = []
 
@@ -195,33 +283,56 @@ class HeatPumpAnalysis :
         self.HPAC_KWhByYear = []
   
         self.updateGraph = False
-        self.updateTemp = True
-        self.updateResistance = True
-
-        def find(name,path):
-            for root,dirs,files in os.walk(path):
-                if name in files:
-                    return os.path.join(root,name)
-        
-        # find the program directory
-        cwd = os.getcwd()
-        heatPumpFile = 'Cold Climate Air-Source Heat Pump Listing.txt'
-        heatPumpFileLoc = find(heatPumpFile,cwd)
-        if heatPumpFileLoc == None:
-            # look up one or two levels to find it
-            os.chdir('..')
-            cwd = os.getcwd()            
-            heatPumpFile = find(heatPumpFile,os.getcwd())
-            if heatPumpFileLoc== None:
-                os.chdir('..')
-                cwd = os.getcwd()            
-                heatPumpFileLoc = find('Cold Climate Air-Source Heat Pump Listing.txt',os.getcwd())
-        if heatPumpFileLoc:
-            self.workingDirectory = heatPumpFileLoc[0:heatPumpFileLoc.find(heatPumpFile)]
+        self.updateTemp = True          # (re)load the temperature data
+        self.updateResistance = True    # recalculate the thermal resistance (otherwise, only when its inputs change)
+
+        # results of the analysis stages, kept to be reused when their inputs have not changed
+        self.resistanceKey = None       # inputs of the resistance calculation (see resistanceInputs)
+        self.deliveriesByYear = None    # baseline units and cost by year from the deliveries, from approxResistance
+        self.demandCache = {}           # hourly heating and cooling requirements, by series, period, settings and resistance
+        self.performanceCache = {}      # performance of a heat pump at the distinct temperatures of a series
+        self.yearCache = OrderedDict()  # results of yearPerformance, by its inputs, least recently used first
+        self.saveResults = True     # append each analysis to the file in 'Output Data'
+        self.useBinMethod = False   # simulate by temperature bins rather than hour by hour
+        self.instruments = None     # Instrumentation of the analyses, if turned on (see instrument)
+        self.analysisResults = None     # AnalysisResults of the last analysis
+
+        # the program directory
+        self.workingDirectory = resolveDataRoot(dataRoot)
             
-        filename = 'Default Oil Deliveries.txt'
-        purchasesFile = self.workingDirectory + 'Residential Profiles/' + filename
-        self.numDeliveries = self.loadFuelDeliveries(purchasesFile)
+        # the weather stations, and the one used (the nearest to the home, where its location is known)
+        self.climateLibrary = ClimateLibrary(self.workingDirectory + 'Climate Data')
+        self.climate = self.climateLibrary.station(DEFAULT_STATION)
+
+        self.deliveriesFile = None      # the fuel deliveries file loaded last
+        if loadDeliveries:
+            self.loadDefaultDeliveries()
+
+    def copy(self):
+        # a copy to analyze while this one may be changed (eg. by the user interface, with the analysis in another thread):
+        # its settings, deliveries, chosen heat pumps and caches are its own (the arrays in them are shared, as they are
+        # not changed in place - except the hourly series, which the copy makes anew); the heat pump list, catalog and
+        # climate data are shared.  takeResults brings the results of its analysis back.
+        other = copy.copy(self)
+        for name, value in self.__dict__.items():
+            if isinstance(value, (list, dict)):
+                setattr(other, name, copy.copy(value))
+        other.approx_Resistance = [list(period) for period in self.approx_Resistance]
+        other.hourlyBuffer = None
+        return other
+
+    def takeResults(self, other):
+        # the state of a copy after its analysis (see copy), replacing this one's
+        self.__dict__.update(other.__dict__)
+        self.hourlyBuffer = None        # (its hourly series may still be in use, eg. by a graph)
+
+    def loadDefaultDeliveries(self):
+        # the default fuel deliveries, unless a deliveries file has been loaded already
+        if self.deliveriesFile is None:
+            filename = 'Default Oil Deliveries.txt'
+            purchasesFile = self.workingDirectory + 'Residential Profiles/' + filename
+            self.numDeliveries = self.loadFuelDeliveries(purchasesFile)
+        return self.numDeliveries
     
     def SetBLScenario(self,BLT) :
         
@@ -392,6 +503,7 @@ class HeatPumpAnalysis :
 
         # this was take from previous code tested using First Parish oil purchases
         # input = open('./Residential Profiles/FP Oil Deliveries.txt')
+        self.deliveriesFile = purchasesFile
         self.numDeliveries = 0
         self.purchase_Quantity.clear()
         self.purchase_Cost.clear()
@@ -399,6 +511,7 @@ class HeatPumpAnalysis :
     
         # read the purchases file
         self.fuelDeliveryHeader = ""
+        self.climate = self.climateLibrary.station(DEFAULT_STATION)    # unless the file gives the home's location
     
         try:
             input = open(purchasesFile,'r', encoding='latin-1')
@@ -428,6 +541,14 @@ class HeatPumpAnalysis :
                 elif HeatSource.find(self.HEAT_NAME_LPG)>=0 :
                     self.SetBLScenario(HEAT_TYPE_LPG)
             
+            if lines[LN].find('Location: ')>=0 :
+                # latitude, longitude of the home, for the nearest weather station
+                try:
+                    lat, lon = lines[LN][lines[LN].find('Location: ')+10:].split(',')[0:2]
+                    self.setLocation(float(lat), float(lon))
+                except ValueError:
+                    print("Unable to read location: "+lines[LN])
+
             if lines[LN].find('$$')>=0 :
                 LN += 1 
                 break;    # locate where the data starts
@@ -576,111 +697,77 @@ class HeatPumpAnalysis :
         self.purchase_Quantity.insert(id,amount)
 
     def loadHeatPumps(self):
-
-        def tF(stringvar):
-            if len(stringvar)==0:
-                return -1.0
-            if stringvar=="#DIV/0!":
-                return -99.0
-            return float((stringvar.replace(',','')).replace('"',''))
-            
-        # read the heat pump data file
-        filename = HEAT_PUMP_FILE_NAME
-        HeatPumpDataFile = self.workingDirectory + filename
-        
-        input = open(HeatPumpDataFile,'r', encoding='latin-1')
-        test = input.read()
-        lines = test.split('\n')
-
-        # Skip ahead to the line which starts "Manufacturer"
-        LN = 0      # step through data starting at first line
-        while True:
-            tokens = lines[LN].split('\t')
-            LN +=1
-            if (tokens[0]=='Manufacturer'):
-                break;
-
-        # ' Load Heat Pump Data
-        while True:
-            
-            if (LN==len(lines)):
-                break
-                
-            tokens = lines[LN].split('\t') 
-            LN += 1
+        # the heat pump listings, parsed once into a catalog (see HeatPumpCatalog) and read from its cache after that
+        with self.span("heat pump catalog"):
+            listings = [self.workingDirectory + filename for filename in HEAT_PUMP_LISTINGS]
+            self.catalog = HeatPumpCatalog([filename for filename in listings if os.path.exists(filename)])
+            self.HPList = self.catalog.heatPumps()
                 
-            if tokens[0]=='': 
-                break               
-            if len(tokens)<50 : 
-                continue
-    
-#           7/19/17 BHN:  Updated to ColdClimateAir=SourceHeatPumpSpecificationListing 7.14.17
-            heatPump = HeatPump(Manufacturer=tokens[0], Brand=tokens[1], ModelName=tokens[2],AHRICertNumber=tokens[3], OutdoorUnit=tokens[4],                
-                IndoorUnits=tokens[5],AHRIType=tokens[6],HSPFregIV=tokens[7],SEER=tokens[8],EER_95=tokens[9],CoolingCapacity=tokens[10],
-                EnergyStar=tokens[11],DuctedDuctless=tokens[12],Zones=tokens[13],DuctlessIndoorType=tokens[14])
-    
-    
-            C1 = 16 # first column with data values, in the file from 7.14.17
-            C2 = 53 # the column with a third optional temperature value
-            try:
-                # calculate linear parameters a and b from the NEEP data
-                tData = [47,17,5]
-                CAPMin = []
-                CAPRated = []
-                CAPMax = []
-                COPMin = []
-                COPRated = []
-                COPMax = []
-                CAPMin.append(tF(tokens[C1+ 0]))
-                CAPMin.append(tF(tokens[C1+10]))
-                CAPMin.append(tF(tokens[C1+20]))
-
-                CAPMax.append(tF(tokens[C1+ 2]))
-                CAPMax.append(tF(tokens[C1+12]))
-                CAPMax.append(tF(tokens[C1+22]))
-            
-                COPMin.append(tF(tokens[C1+ 6]))
-                COPMin.append(tF(tokens[C1+16]))
-                COPMin.append(tF(tokens[C1+26]))
+    def typicalYears(self, status=None):
+        # (median heating degree-hour, highest heating, median cooling, highest cooling) years of the climate data
+        def loading(filename):
+            self.showStatus(status, "Ranking climate years: "+filename)
+        years = self.climate.typicalYears(loading)
+        if years is None:
+            years = (AVERAGE_HDD_YEAR, HIGHEST_HDD_YEAR, AVERAGE_CDD_YEAR, HIGHEST_CDD_YEAR)
+        return years
+
+    def setLocation(self, lat, lon):
+        # use the climate data of the weather station nearest a location (latitude, longitude in degrees)
+        station = self.climateLibrary.nearestStation(lat, lon)
+        if station is not None and station != self.climate.station:
+            self.climate = self.climateLibrary.station(station)
+        return self.climate.station
+
+    def instrument(self, profile=False, save=False):
+        # time the stages of each analysis and count the work done (see Instrumentation), returning the Instrumentation
+        # profile: profile the next analysis with cProfile
+        # save: append the results of each analysis to 'Output Data/Heat Pump Analysis-<date>-instrumentation.jsonl'
+        # (when the analysis is saved)
+        if self.instruments is None:
+            self.instruments = Instrumentation()
+        self.instruments.profile = profile
+        self.instruments.save = save
+        return self.instruments
+
+    def instrumentation(self):
+        # stage timings, counters and profile of the last analysis, as a dictionary (None if not instrumented)
+        if self.instruments is None:
+            return None
+        return self.instruments.results()
+
+    def span(self, stage):
+        # a with block timing a stage, if instrumented
+        if self.instruments is None:
+            return NO_SPAN
+        return self.instruments.span(stage)
+
+    def startSpan(self, stage):
+        # start timing a stage, if instrumented, to be ended by endSpan
+        if self.instruments is not None:
+            return self.instruments.start(stage)
+
+    def endSpan(self, span):
+        if span is not None:
+            self.instruments.stop(span)
+
+    def count(self, name, n=1):
+        if self.instruments is not None:
+            self.instruments.count(name, n)
+
+    def showStatus(self, status, stage, fraction=None):
+        # report progress to status, if there is one: a function status(stage, fraction), or a Tk label
+        # (either may raise AnalysisCancelled to stop the analysis)
+        if status is None:
+            return
+        if hasattr(status, 'config'):
+            status.config(text=stage)
+            status.update()
+        else:
+            status(stage, fraction)
 
-                COPMax.append(tF(tokens[C1+ 8]))
-                COPMax.append(tF(tokens[C1+18]))
-                COPMax.append(tF(tokens[C1+28]))
-                
-                if (len(tokens[C2])>0) & (tokens[C2] != 'N/A'):
-                    tMin = tF(tokens[C2])
-                    tData.append(tMin)
-                    capMin = tF(tokens[C2+1])
-                    capMax = tF(tokens[C2+3])
-                    copMin = tF(tokens[C2+7])
-                    copMax = tF(tokens[C2+9])
-                    if capMin<0. :
-                        capMin = capMax
-                        copMin = copMax
-                        
-                    CAPMin.append(capMin)
-                    CAPMax.append(capMax)
-                    COPMin.append(copMin)
-                    COPMax.append(copMax)
-            
-                heatPump.tData = tData
-                heatPump.CAPMin = CAPMin
-                heatPump.CAPMax = CAPMax 
-                heatPump.COPMin = COPMin
-                heatPump.COPMax = COPMax
-                   
-#               heatPump.parametrize()
-
-                self.HPList.append(heatPump)
-            
-            except Exception as e:
-                print(e)
-                
-    def LoadTempDataRaw(self,status, year=0):
+    def LoadTempDataRaw(self,status=None, year=0):
     
-        self.T_Outdoor.clear()
-        self.t_Data.clear()
-
         if year==0:
             yearStart = self.purchase_Date[0].year
             if yearStart<2002 :
@@ -689,95 +776,78 @@ class HeatPumpAnalysis :
         else:
             yearStart = yearEnd = year
         
-        prevTemp = -999
-        oneHour = datetime.timedelta(0,0,0,0,0,1,0)
-    
-        # loop over files from these years
-        ClimaticDataPath = self.workingDirectory + 'Climate Data/KBED'
-        for year in range(yearStart,yearEnd+1):
-            filename = "%s-%i.txt" % (ClimaticDataPath, year) 
-            print("Reading "+filename)
-        
-            # can one get this information to the UI?  (updating a text widget)
-            status.config(text="Loading temperature data from: "+filename)
-            status.update()
-
-            LN = -1
-            nextHour = datetime.datetime(year,1,1,0,0)
-            for line in open(filename,'r',encoding='latin-1'):
-                LN+=1
-                if LN==0: 
-                    continue
-                tokens = line.rstrip().split('\t')
-                if len(tokens)<1:
-                    print("len(tokens)<1") 
-                    break
-                try:
-                    datestring = tokens[0]
-                    if datestring.find('-') == 1 : 
-                        datestring = "0"+datestring
-                    if datestring.find('-',3,5) == 4 :
-                        datestring = datestring[0:3]+"0"+datestring[3:]
-                    if datestring.find(':') == 12 :
-                        datestring = datestring[0:11]+"0"+datestring[11:]
-                    dateTime = datetime.datetime.strptime(datestring[0:-4], "%m-%d-%Y %H:%M")
-                except:     # hit the line past the date lines
-                    break
+        years = (self.climate.station, yearStart, yearEnd)
+        if self.updateTemp:
+            # start again from the climate data
+            self.t_Series.clear()
+            self.performanceCache.clear()
+            self.yearCache.clear()
+            self.t_Years = None
+            self.updateTemp = False
+        if years == self.t_Years:
+            self.count("series cache hits")
+            return
 
-                try:
-                    temp = float(tokens[1])
-                except:
-                    pass
-                
-                # record hourly data when the next dateTime point is past the nextHour to be recorded     
-                while nextHour<dateTime :
-                    self.t_Data.append(nextHour)
-                    self.T_Outdoor.append(temp)                
-                    nextHour = nextHour+oneHour  
-            
-    def LoadTempData(self):     # OBSOLETE
-        # Load climatic data
-        # Find location of the start of the year of the heating period
+        # a series kept from before, or the hourly data for these years (parsed once and then read from the binary cache)
+        # loaded before anything is changed, in case the analysis is cancelled meanwhile
+        series = self.t_Series.pop(years, None)
+        if series is None:
+            def loading(filename):
+                self.showStatus(status, "Loading temperature data from: "+filename)
+            loads = dict(self.climate.loads)
+            # the temperatures as float64, copied once from the (memory mapped, float32) years: the values are the same,
+            # but arithmetic with float32 arrays stays in float32 (with numpy 2), which would change the demand,
+            # performance and totals from the results the analysis has always given
+            hours, temps = self.climate.load(yearStart, yearEnd, loading, dtype=float)
+            self.count("series built")
+            for source, name in (('parsed',"climate files parsed"), ('cached',"climate cache reads"), ('memory',"climate years in memory")):
+                self.count(name, self.climate.loads[source] - loads[source])
+        else:
+            self.count("series cache hits")
+
+        # keep the current series, and switch
+        if self.t_Years is not None:
+            self.t_Series[self.t_Years] = dict((name, getattr(self, name, None)) for name in SERIES_ATTRIBUTES)
+            if len(self.t_Series) > SERIES_CACHE_SIZE:
+                del self.t_Series[next(iter(self.t_Series))]
+        self.t_Years = years
+        if series is not None:
+            for name, value in series.items():
+                setattr(self, name, value)
+            return
 
-        # Improvement would be to load from mesowest.utah.edu for the location specified
+        self.t_Hours = hours
+        self.T_Outdoor = temps
+        self.t_SeasonKey = None
 
-        # read the climatic data file
-        ClimaticDataFile = './Superseded/Modified Temp data.txt'
-        first = True
-        LN = -1
-        NextLN = 2
-        for line in open(ClimaticDataFile):
-            LN += 1
-            if LN<NextLN :  continue
-            if len(line)>1 :            
-                tokens = line.split('\t')
-                dateTime = datetime.datetime.strptime(tokens[3], "%m/%d/%y %H:%M")
-            else:
-                break
-        
-            if first:
-                # Find location of the start of the year of the heating period
-                FirstDateTime = dateTime
-                year_Start = 24 * (datetime.datetime(purchase_Date[0].year, 1, 1,0,0) - FirstDateTime)
-           
-                # Quickly jump to January 1st of the purchase date (or year under scrutiny)
-#               LN += year_Start.days - 1
-                NextLN = LN+year_Start.days
-                first = False;
+        # the distinct temperatures, and which one each hour has (heat pump performance is found for these only)
+        self.t_TempValues, self.t_TempIndex = np.unique(self.T_Outdoor, return_inverse=True)
+        self.t_TempIndex = self.t_TempIndex.reshape(-1)
 
-            else :
-                #Loop through the temperature data
-                self.t_Data.append(dateTime)
-                self.T_Outdoor.append(float(tokens[4]))
+        # the first and last index of the hours on each date (see hourIndex)
+        days, first = np.unique(hours.astype('datetime64[D]'), return_index=True)
+        last = np.append(first[1:], len(hours)) - 1
+        self.t_DayIndex = dict(zip(days.astype(object).tolist(), zip(first.tolist(), last.tolist())))
+            
+    def doHeatPumpAnalysis(self,status=None): 
+        # the analysis (see analyzeHeatPumps), timed and profiled when instrumented
+        # returns the AnalysisResults (str() of which is the report), or a message if there is nothing to analyze
+        if self.instruments is None:
+            return self.analyzeHeatPumps(status)
+
+        with self.instruments.run():
+            results = self.analyzeHeatPumps(status)
+        if self.instruments.save and self.saveResults:
+            now = datetime.date.today().isoformat()
+            self.instruments.saveResults(self.workingDirectory + 'Output Data/Heat Pump Analysis-'+now+'-instrumentation.jsonl',
+                                         time=datetime.datetime.now().isoformat(timespec='seconds'), 
+                                         deliveries=self.deliveriesFile, station=self.climate.station,
+                                         heatPumps=[hp.AHRICertNumber for hp in self.HPChoice])
+        return results
 
-        print("Temperature data loaded")        
- 
-    def doHeatPumpAnalysis(self,status): 
-        # certain years of note since 1993
-        AverageHDDYear = 2008
-        AverageCDDYear = 2003
-        HighestHDDYear = 2003
-        HighestCDDYear = 2010
+    def analyzeHeatPumps(self,status=None): 
+        with self.span("typical years"):
+            AverageHDDYear, HighestHDDYear = self.typicalYears(status)[0:2]
     
         if len(self.HPChoice)==0 and self.HPWaterHeaterCOP==0 and self.SuppHeatType==self.BaseHeatType:
             msg = "No heat pump or H.P. water heater selected"
@@ -796,105 +866,61 @@ class HeatPumpAnalysis :
                 if n<len(self.HPChoice):
                     hpNames += "+"
 
-        if self.updateTemp :
-            # pass info back to UI status bar
-            status.config(text="Loading temperature data for period")
-            status.update()
+        # each stage is redone only if its inputs have changed: the temperature data is kept by years, and the
+        # thermal resistance is recalculated when the deliveries, baseline system or heating season change
+        self.showStatus(status, "Loading temperature data for period", 0.)
+        with self.span("climate load"):
             self.LoadTempDataRaw(status)
-            self.updateTemp = False
 
-        self.updateResistance = True
-        if self.updateResistance :
-            status.config(text="Calculating home thermal resistance")
-            status.update()
-            self.approxResistance()
+        resistanceKey = self.resistanceInputs()
+        if self.updateResistance or resistanceKey != self.resistanceKey :
+            self.showStatus(status, "Calculating home thermal resistance", 0.2)
+            with self.span("resistance fit"):
+                self.approxResistance()
+            self.resistanceKey = resistanceKey
+            self.deliveriesByYear = (list(self.BaseUnitsByYear), list(self.BaseCostByYear))
             self.updateResistance = False
+        else:
+            # the average and coldest year analysis replaces the first of these
+            self.count("resistance reused")
+            self.BaseUnitsByYear = list(self.deliveriesByYear[0])
+            self.BaseCostByYear = list(self.deliveriesByYear[1])
 
         if len(self.HPChoice)>0:
-            status.config(text="Analyzing heat pump performance")
-            status.update()
-            p = self.heatPumpPerformance(0)
+            self.showStatus(status, "Analyzing heat pump performance", 0.3)
+            with self.span("hourly simulation"):
+                p = self.heatPumpPerformance(0)
         elif self.SuppHeatType != self.BaseHeatType:
-            status.config(text="Analyzing supplemental system performance")  
-            status.update()
-            p = self.heatPumpPerformance(0)
+            self.showStatus(status, "Analyzing supplemental system performance", 0.3)
+            with self.span("hourly simulation"):
+                p = self.heatPumpPerformance(0)
         
+        span = self.startSpan("yearly results")
         totSavings = totBaseEmissions = totHPEmissions = totSuppEmissions = 0.
         totHPACEmissions = totBLACEmissions = 0.0
         totHPHWEmissions = totBLHWEmissions = 0.0
     
         BLAC = self.BaselineAC != 0 and self.SummerBLSetPoint> 0
         HPAC = self.SummerHPSetPoint>0
-
-        # header line
-        if len(self.HPChoice)>0:
-            results = "\nAnalysis of heat pump performance for " + hpNames +"\n\n"
-        elif self.HPWaterHeaterCOP>0:
-            results = "\nAnalysis of heat pump water heater, COP = %.1f\n\n" % (self.HPWaterHeaterCOP)
-        elif SuppHeatType != BaseHeatType:
-            results = "\nAnalysis of supplemental heat system change to %s\n\n" % (self.SuppHeatType)
-        
-        # First line of table
-        results += "\tBaseline ("+self.BaseHeatType+")\t\t"
-
-        if (self.WaterHeatType == self.BaseHeatType and self.WaterHeatMonthlyUsage>0) or self.WaterHeatType == self.HEAT_NAME_ELEC:
-            results += "Hot Water\t\t"
-        
-        if BLAC:
-            results += "Air Conditioning\t\t"
-
-        results += " |  "
-
-        if len(self.HPChoice)>0:
-            results += "Heat Pump\t\t\t"
-        
-        if self.HPWaterHeaterCOP>0:
-            results += "Hot Water\t\t"
-        if len(self.HPChoice)>0 or self.SuppHeatType != self.BaseHeatType:
-            results += " |  "
-            results += "Supplemental ("+self.SuppHeatType+")\t\t\t"
-
-        if len(self.HPChoice)>0:
-                results += "Air Conditioning"
-
-        results +="\n"
-    
-        # second line of table
-        results += "Year\t"+self.BaseEnergyUnits+"\tCost\t"
-
-        if self.WaterHeatType == self.BaseHeatType and self.WaterHeatMonthlyUsage>0:
-            results += self.BaseEnergyUnits+"\tCost\t"
-        elif self.WaterHeatType==self.HEAT_NAME_ELEC:
-            results += "KWh\tCost\t"
-        
-
-        if BLAC:
-            results += "kWh\tCost\t"
-
-        results += " |  "
-
-        if len(self.HPChoice)>0:
-            results += "KWh\tCost\tCOP\t"
-        
-        if self.HPWaterHeaterCOP>0:
-            results += "KWh\tCost\t"
-        
-        if len(self.HPChoice)>0 or self.SuppHeatType!=self.BaseHeatType:
-            results += " |  "
-
-            results += "#days\t"+self.SuppEnergyUnits+"\tCost\t"
-        if len(self.HPChoice)>0:
-            results += "kWh\tCost\t"
-
-        results += "\n"
-
-        startYear = self.t_Data[self.t_Start].year
-        endYear = self.t_Data[self.t_End].year
-        for year in range(startYear+1,endYear+1):     # first and last years tend to be truncated, with potentially misleading results
+        heatPumps = len(self.HPChoice)>0
+        supplemental = heatPumps or self.SuppHeatType!=self.BaseHeatType
+
+        # the results by year, a list for each of YEAR_COLUMNS, formatted only when the report is asked for
+        # (see AnalysisResults)
+        startYear = self.hourYear(self.t_Start)
+        endYear = self.hourYear(self.t_End)
+        years = range(startYear+1,endYear+1)     # first and last years tend to be truncated, with potentially misleading results
+        columns = dict((name, [0.]*len(years)) for name in YEAR_COLUMNS)
+        columns['Year'] = list(years)
+        columns['SuppUses'] = [0]*len(years)
+
+        waterUsage = 12.*self.WaterHeatMonthlyUsage
+        HPWaterUnits = 0
+        for i, year in enumerate(years):
             Y = year-startYear
 
-            resultline = "%d\t%.0f\t$%.0f\t" % (year,self.BaseUnitsByYear[Y],self.BaseCostByYear[Y])
-            waterUsage = 12.*self.WaterHeatMonthlyUsage
+            columns['BaseUnits'][i] = self.BaseUnitsByYear[Y]
+            columns['BaseCost'][i] = self.BaseCostByYear[Y]
             if waterUsage>0:
                 if self.WaterHeatType==self.BaseHeatType:
                     waterCost = waterUsage*(self.BaseCostByYear[Y]/self.BaseUnitsByYear[Y])
@@ -904,89 +930,99 @@ class HeatPumpAnalysis :
                 else:
                     waterCost = 0
                     print("WaterHeatType="+self.WaterHeatType)
-                resultline += "%.0f\t$%.0f\t" % (waterUsage,waterCost )  
-            if BLAC and (len(self.HPChoice)>0):
-                resultline += "%.0f\t$%.0f\t" % (self.BLAC_KWhByYear[Y],self.BLAC_KWhByYear[Y]*self.STANDARD_PRICE_ELEC)
-        
-            resultline += " |  "
+                columns['WaterUnits'][i] = waterUsage
+                columns['WaterCost'][i] = waterCost
+            if BLAC and heatPumps:
+                columns['BLACKWh'][i] = self.BLAC_KWhByYear[Y]
+                columns['BLACCost'][i] = self.BLAC_KWhByYear[Y]*self.STANDARD_PRICE_ELEC
 
-            if len(self.HPChoice)>0:
+            if heatPumps:
                 COPAve = self.BaseUnitsByYear[Y]*self.BaseHvacEfficiency*(self.BaseEnergyContent/ENERGY_CONTENT_ELEC)/self.KWhByYear[Y]
-                resultline += "%.0f\t$%.0f\t%.1f\t" % (self.KWhByYear[Y],self.KWhByYear[Y]*self.STANDARD_PRICE_ELEC,COPAve)
+                columns['HPKWh'][i] = self.KWhByYear[Y]
+                columns['HPCost'][i] = self.KWhByYear[Y]*self.STANDARD_PRICE_ELEC
+                columns['COP'][i] = COPAve
 
             HPWaterUnits = 0
             if self.HPWaterHeaterCOP>0:
                 HPWaterUnits = 12.*self.WaterHeatMonthlyUsage*self.WaterEnergyContent/ENERGY_CONTENT_ELEC/self.HPWaterHeaterCOP
                 if self.WaterHeatCombinedBill:
                     HPWaterUnits *= self.BaseHvacEfficiency
-                resultline += "%.0f\t$%.0f\t" % (HPWaterUnits,HPWaterUnits*self.STANDARD_PRICE_ELEC)
-
-            resultline += " |  "
-
-            if len(self.HPChoice)>0 or self.SuppHeatType!=self.BaseHeatType:
-                resultline += "%d\t%.0f\t$%.0f\t" % (self.SuppUsesByYear[Y],self.SuppUnitsByYear[Y],                
-                                                    self.SuppUnitsByYear[Y]*self.SuppCostPerUnit)
-        
-                if len(self.HPChoice)>0:
-                    if HPAC:
-                        resultline += "%.0f\t$%.0f" % (self.HPAC_KWhByYear[Y],self.HPAC_KWhByYear[Y]*self.STANDARD_PRICE_ELEC)
-            
-            resultline += "\n"
-            
-            results += resultline
-
-            if len(self.HPChoice)>0 or self.SuppHeatType!=self.BaseHeatType:
-                totSavings += self.BaseCostByYear[Y] - (self.KWhByYear[Y]*self.STANDARD_PRICE_ELEC + self.SuppUnitsByYear[Y]*self.SuppCostPerUnit) 
-            if len(self.HPChoice)>0 and (BLAC or HPAC) :
-                totSavings += (self.BLAC_KWhByYear[Y]-self.HPAC_KWhByYear[Y]) * self.STANDARD_PRICE_ELEC
+                columns['HPWaterKWh'][i] = HPWaterUnits
+                columns['HPWaterCost'][i] = HPWaterUnits*self.STANDARD_PRICE_ELEC
+
+            if supplemental:
+                columns['SuppUses'][i] = self.SuppUsesByYear[Y]
+                columns['SuppUnits'][i] = self.SuppUnitsByYear[Y]
+                columns['SuppCost'][i] = self.SuppUnitsByYear[Y]*self.SuppCostPerUnit
+                if heatPumps and HPAC:
+                    columns['HPACKWh'][i] = self.HPAC_KWhByYear[Y]
+                    columns['HPACCost'][i] = self.HPAC_KWhByYear[Y]*self.STANDARD_PRICE_ELEC
+
+            # (the totals summed in the same order as always, so that they round the same)
+            savings = []
+            if supplemental:
+                savings.append(self.BaseCostByYear[Y] - (self.KWhByYear[Y]*self.STANDARD_PRICE_ELEC + self.SuppUnitsByYear[Y]*self.SuppCostPerUnit))
+            if heatPumps and (BLAC or HPAC) :
+                savings.append((self.BLAC_KWhByYear[Y]-self.HPAC_KWhByYear[Y]) * self.STANDARD_PRICE_ELEC)
             if self.HPWaterHeaterCOP>0:
-                totSavings += 12.*self.WaterHeatMonthlyUsage * self.WaterCostPerUnit - HPWaterUnits*self.STANDARD_PRICE_ELEC
+                savings.append(12.*self.WaterHeatMonthlyUsage * self.WaterCostPerUnit - HPWaterUnits*self.STANDARD_PRICE_ELEC)
+            for saving in savings:
+                totSavings += saving
+            columns['Savings'][i] = sum(savings)
             
-            totBaseEmissions += self.BaseKgCO2PerUnit*self.BaseUnitsByYear[Y]
-            totBLHWEmissions += self.WaterKgCO2PerUnit*waterUsage
-            if len(self.HPChoice)>0 or self.SuppHeatType!=self.BaseHeatType:
-                totHPEmissions   += self.ElecKgCO2PerUnit*self.KWhByYear[Y]
-                totSuppEmissions += self.SuppKgCO2PerUnit*self.SuppUnitsByYear[Y]
-            if len(self.HPChoice)>0 and (BLAC or HPAC):
-                totBLACEmissions += self.BLAC_KWhByYear[Y]*self.ElecKgCO2PerUnit
-                totHPACEmissions += self.HPAC_KWhByYear[Y]*self.ElecKgCO2PerUnit
-            totHPHWEmissions += HPWaterUnits*self.ElecKgCO2PerUnit
+            columns['BaseKgCO2'][i] = self.BaseKgCO2PerUnit*self.BaseUnitsByYear[Y]
+            columns['BaseWaterKgCO2'][i] = self.WaterKgCO2PerUnit*waterUsage
+            if supplemental:
+                columns['HPKgCO2'][i] = self.ElecKgCO2PerUnit*self.KWhByYear[Y]
+                columns['SuppKgCO2'][i] = self.SuppKgCO2PerUnit*self.SuppUnitsByYear[Y]
+            if heatPumps and (BLAC or HPAC):
+                columns['BLACKgCO2'][i] = self.BLAC_KWhByYear[Y]*self.ElecKgCO2PerUnit
+                columns['HPACKgCO2'][i] = self.HPAC_KWhByYear[Y]*self.ElecKgCO2PerUnit
+            columns['HPWaterKgCO2'][i] = HPWaterUnits*self.ElecKgCO2PerUnit
+
+            totBaseEmissions += columns['BaseKgCO2'][i]
+            totBLHWEmissions += columns['BaseWaterKgCO2'][i]
+            if supplemental:
+                totHPEmissions   += columns['HPKgCO2'][i]
+                totSuppEmissions += columns['SuppKgCO2'][i]
+            if heatPumps and (BLAC or HPAC):
+                totBLACEmissions += columns['BLACKgCO2'][i]
+                totHPACEmissions += columns['HPACKgCO2'][i]
+            totHPHWEmissions += columns['HPWaterKgCO2'][i]
     
-        if totSavings>0 :
-            savingsImpact = "saved"
-        else:
-            savingsImpact = "cost an additional"
-        
         CO2_percent_impact = 0
-        if len(self.HPChoice)>0 or self.SuppHeatType!=self.BaseHeatType:
+        if supplemental:
             CO2_percent_impact += (100.*(totBaseEmissions  - totHPEmissions - totSuppEmissions))
         if BLAC or HPAC:
             CO2_percent_impact += (100.*(totBLACEmissions- totHPACEmissions))
         if totHPHWEmissions > 0:
             CO2_percent_impact += 100.*(totBLHWEmissions - totHPHWEmissions)
         CO2_percent_impact /= (totBaseEmissions+totBLACEmissions+totBLHWEmissions)
-        if CO2_percent_impact>0 : 
-            CO2Impact = "less"
-        else:
-            CO2Impact = "more"
 
-        if len(self.HPChoice)>0:
+        if heatPumps:
             change = "heat pump system"
         elif self.HPWaterHeaterCOP>0:
             change = "heat pump water heater"
         elif self.SuppHeatType!=self.BaseHeatType:
             change = "change to "+self.SuppHeatType
-        results += "\nOver the years %d-%d, the %s would have %s $%.0f, emitting %.0f%% %s CO2eq than %s\n" % (startYear+1,endYear-1,change,savingsImpact, abs(totSavings), CO2_percent_impact, CO2Impact,self.BaseHeatType)
-
+        summary = OrderedDict([('FirstYear', startYear+1), ('LastYear', endYear-1), ('Savings', totSavings), 
+                               ('CO2Percent', CO2_percent_impact), ('BaseKgCO2', totBaseEmissions), 
+                               ('BaseWaterKgCO2', totBLHWEmissions), ('BLACKgCO2', totBLACEmissions), 
+                               ('HPKgCO2', totHPEmissions), ('HPWaterKgCO2', totHPHWEmissions), 
+                               ('SuppKgCO2', totSuppEmissions), ('HPACKgCO2', totHPACEmissions)])
+        self.endSpan(span)
+
+        typicalYears = []
         analyzeExtremes = True
-        if len(self.HPChoice)>0 and analyzeExtremes:
+        if heatPumps and analyzeExtremes:
+            span = self.startSpan("extremes")
             # BHN 7/20/17 - update prices for baseline and supplemental heat to be the standard price set from the Fuel Options page
             self.UpdatePrices()
 
             for year in (AverageHDDYear, HighestHDDYear) :
             # average year first
-                self.LoadTempDataRaw(status,year)
-                self.heatPumpPerformance(year)
+                self.showStatus(status, "Analyzing heating year %d" % year, 0.5 if year==AverageHDDYear else 0.7)
+                self.yearPerformance(status,year)
 
                 totBaseEmissions = self.BaseKgCO2PerUnit*self.BaseUnitsByYear[0]
                 totBLHWEmissions = self.WaterKgCO2PerUnit*waterUsage
@@ -1002,20 +1038,11 @@ class HeatPumpAnalysis :
                 # Bug fix: add hot water heater savings for average and coldest years
                 if self.HPWaterHeaterCOP>0:
                     totSavings += 12.*self.WaterHeatMonthlyUsage * self.WaterCostPerUnit - HPWaterUnits*self.STANDARD_PRICE_ELEC
-                if totSavings>0 :
-                    savingsImpact = "saved"
-                else:
-                    savingsImpact = "cost an additional"
     
                 CO2_percent_impact = (100.*(totBaseEmissions + totBLACEmissions - totHPEmissions - totSuppEmissions- totHPACEmissions))
                 if totHPHWEmissions > 0:
                     CO2_percent_impact += 100.*(totBLHWEmissions - totHPHWEmissions)
                 CO2_percent_impact /= (totBaseEmissions+totBLACEmissions+totBLHWEmissions)
-            
-                if CO2_percent_impact>0 : 
-                    CO2Impact = "less"
-                else:
-                    CO2Impact = "more"
     
                 percentOfLoad = 100.* (self.totalRequiredHeating  - self.SuppUnitsByYear[0]*self.SuppEnergyContent)/self.totalRequiredHeating
             
@@ -1034,19 +1061,38 @@ class HeatPumpAnalysis :
                     adj = "Average"
                 else:
                     adj = "Coldest"
-                results += "%s heating year (%d), heat pump covers " % (adj,year)
-                results += "%.1f%% of heating load, %s $%.0f, " % (percentOfLoad,savingsImpact,abs(totSavings))
-                results += "emits %.0f%% %s CO2 than %s\n" % (CO2_percent_impact,CO2Impact,self.BaseHeatType)
-            
-            self.updateTemp = True
-
-        status.config(text="Saving results")
-        status.update()
-        self.outputData(results)
+                typicalYears.append(OrderedDict([('Name', adj), ('Year', int(year)), ('HeatPumpCoverage', percentOfLoad), 
+                                                 ('Savings', totSavings), ('CO2Percent', CO2_percent_impact),
+                                                 ('BaseUnits', self.BaseUnitsByYear[0]), ('HPKWh', self.KWhByYear[0]),
+                                                 ('SuppUnits', self.SuppUnitsByYear[0]), ('HPACKWh', self.HPAC_KWhByYear[0])]))
+            self.endSpan(span)
+
+        if heatPumps:
+            hpLabel = hpNames
+        else:
+            hpLabel = None
+        if self.WaterHeatType == self.BaseHeatType and self.WaterHeatMonthlyUsage>0:
+            waterUnits = self.BaseEnergyUnits
+        elif self.WaterHeatType==self.HEAT_NAME_ELEC:
+            waterUnits = "KWh"
+        else:
+            waterUnits = None
+        results = AnalysisResults(columns, summary, typicalYears, heatPumps=hpLabel, change=change, 
+                                  waterHeaterCOP=self.HPWaterHeaterCOP, baseHeatType=self.BaseHeatType, 
+                                  suppHeatType=self.SuppHeatType, baseUnits=self.BaseEnergyUnits, 
+                                  suppUnits=self.SuppEnergyUnits, waterUnits=waterUnits, waterRows=waterUsage>0, 
+                                  baselineAC=BLAC, heatPumpAC=HPAC)
+        self.analysisResults = results
+
+        if self.saveResults:
+            self.showStatus(status, "Saving results", 0.95)
+            with self.span("outputData"):
+                self.outputData(results)
 
         if len(self.HPChoice)>0:
             self.updateGraph = True
 
+        self.showStatus(status, "Analysis done", 1.)
         return results
         
     def isHeating(self,t) :
@@ -1056,50 +1102,51 @@ class HeatPumpAnalysis :
 # 1, The outdoor temp is lower than the min operating temp of the heat pump
 # 2, It is in the summer time before your specified turn_ON_Date and after the turn_OFF_Date
 # 3, The heat pump overshoot for that particular hour and so is cycling (not much modelling has been done to simumlate cycling)
+# now a look up in the arrays from seasonMasks
 
-        if self.t_Data[t] <= datetime.datetime(self.t_Data[t].year, self.turn_OFF_Date.month, self.turn_OFF_Date.day) :
-            self.current_Heating_Year = self.t_Data[t].year - 1    
-        else:
-            self.current_Heating_Year = self.t_Data[t].year
-    
-        self.yr_Turn_OFF = datetime.datetime(self.current_Heating_Year + 1, self.turn_OFF_Date.month, self.turn_OFF_Date.day)
-        self.yr_Turn_ON = datetime.datetime(self.current_Heating_Year, self.turn_ON_Date.month, self.turn_ON_Date.day)
-
-#    if (t_Data[t_Start] <= t_Data[t]) and (t_Data[t] <= yr_Turn_OFF) and \
-#    (yr_Turn_ON <= t_Data[t]) and (t_Data[t] <= t_Data[t_End]) and (T_Outdoor[t] < WinterHPSetPoint) :
-        if (self.t_Data[t] <= self.yr_Turn_OFF) and (self.yr_Turn_ON <= self.t_Data[t]) and (self.T_Outdoor[t] < self.WinterHPSetPoint) :
-        # t is within range of the heating period and purchase period and the outdoor temperature is below the indoor temperature
-            return True
-        else:
-            return False    
+        heatingYear, inSeason, heating, cooling = self.seasonMasks()
+        self.current_Heating_Year = int(heatingYear[t])
+        return bool(heating[t])
             
     def isCooling(self,t) :
+# this function determines if the heat pump should cool the room at this particular time (not if heating)
+
+        heatingYear, inSeason, heating, cooling = self.seasonMasks()
+        self.current_Heating_Year = int(heatingYear[t])
+        return bool(cooling[t])
+
+    def seasonMasks(self):
+        # arrays for each hour of the loaded temperature data: the heating year (in which that heating season started),
+        # whether in the heating season (turn_ON_Date of the heating year through turn_OFF_Date of the next), and whether
+        # heating or cooling (heating has priority)
+        # made when first needed, and again only when the data, the season dates or the set points change
+        seasonKey = (self.turn_ON_Date, self.turn_OFF_Date)
+        if self.t_SeasonKey != seasonKey:
+            def seasonDate(years, day):
+                return ((years-1970).astype('datetime64[Y]').astype('datetime64[M]') + (day.month-1)).astype('datetime64[D]') + (day.day-1)
+
+            years = self.t_Hours.astype('datetime64[Y]').astype(int) + 1970
+            self.t_HeatingYear = years - (self.t_Hours <= seasonDate(years, self.turn_OFF_Date))
+            self.t_InSeason = ((self.t_Hours <= seasonDate(self.t_HeatingYear+1, self.turn_OFF_Date)) & 
+                               (self.t_Hours >= seasonDate(self.t_HeatingYear, self.turn_ON_Date)))
+            self.t_SeasonKey = seasonKey
+            self.t_MaskKey = None
+
+        maskKey = (self.WinterHPSetPoint, self.SummerHPSetPoint)
+        if self.t_MaskKey != maskKey:
+            self.t_Heating = self.t_InSeason & (self.T_Outdoor < self.WinterHPSetPoint)
+            self.t_Cooling = ~self.t_Heating & (self.T_Outdoor > self.SummerHPSetPoint)
+            self.t_MaskKey = maskKey
+
+        return self.t_HeatingYear, self.t_InSeason, self.t_Heating, self.t_Cooling
 
-# this function determines if the cooling should be applied at this time
-# Reasons why your heat pump may not turn ON include, but not limited to the following,:
-# 1, The outdoor temp is lower than the min operating temp of the heat pump
-# 2, It is in the summer time before your specified turn_ON_Date and after the turn_OFF_Date
-# 3, The heat pump overshoot for that particular hour and so is cycling (not much modelling has been done to simumlate cycling)
-
-        if self.t_Data[t] <= datetime.datetime(self.t_Data[t].year, self.turn_OFF_Date.month, self.turn_OFF_Date.day) :
-            self.current_Heating_Year = self.t_Data[t].year - 1    
-        else:
-            self.current_Heating_Year = self.t_Data[t].year
-    
-        self.yr_Turn_OFF = datetime.datetime(self.current_Heating_Year + 1, self.turn_OFF_Date.month, self.turn_OFF_Date.day)
-        self.yr_Turn_ON = datetime.datetime(self.current_Heating_Year, self.turn_ON_Date.month, self.turn_ON_Date.day)
-
-        if (self.T_Outdoor[t] > self.SummerHPSetPoint) :
-        # t is within range of the heating period and purchase period and the outdoor temperature is below the indoor temperature
-            return True
-        else:
-            return False        
-    
     def approxResistance(self):
     # Adapted from VBA project, Author: Jonah Kadoko
     # Decide the hour to start and stop the calculations
     # 1, t_Start should be the index of time corresponding to the second purchase date (since the customer fills up their tank each time)
     # 2, t_End should be  the date corresponding the last purchase date
+    # Hours are found from dates with the day index of the temperature data (see hourIndex), and the sums over
+    # hours are taken over array slices, with the same results as the original hour by hour loops
     
         p = 0
         self.approx_Resistance.clear()
@@ -1108,7 +1155,6 @@ class HeatPumpAnalysis :
             p+=1
             if p==self.numDeliveries: break
 
-        t = 0    
         self.t_Start = self.t_End = 0
  
         p = self.numDeliveries-1
@@ -1116,36 +1162,38 @@ class HeatPumpAnalysis :
         if self.purchase_Quantity[p] == 0 :
             self.last_Purchase = p - 1
     
-        while t<len(self.t_Data):    # (t_Start == 0) or (t_End == 0):
-            if (self.t_Start==0):
-                if self.purchase_Date[0] == self.t_Data[t].date() :
-                # All calculations should start a day after the customer fills up their tank around the start of the year
-                # t_Start is the index of the time the customer fi
-                    self.t_Start = t
-
-            elif (self.t_End==0 and self.purchase_Date[self.last_Purchase] == self.t_Data[t].date()) :
-            # calculations should stop at the last purchase date of the year
+        # first hour of the first purchase date, and the first hour after it on the last purchase date
+        # (when the first purchase date is the first day of the data, the original search settled on its second hour)
+        t = self.hourIndex(self.purchase_Date[0])
+        if t is not None:
+            self.t_Start = t
+            if t==0 and self.hourIndex(self.purchase_Date[0], 1)==1:
+                self.t_Start = 1
+            t = self.hourIndex(self.purchase_Date[self.last_Purchase], self.t_Start+1)
+            if t is not None:
                 self.t_End = t
-                break
-
-            t = t + 1
 
         if self.t_End==0 :
-            self.t_End = len(self.t_Data)-1
+            self.t_End = len(self.t_Hours)-1
         
-        startYear = self.t_Data[self.t_Start].year
-        endYear = self.t_Data[self.t_End].year
+        startYear = self.hourYear(self.t_Start)
+        endYear = self.hourYear(self.t_End)
         self.BaseUnitsByYear.clear()
         self.BaseCostByYear.clear()
         for year in range(startYear,endYear+1):
             self.BaseUnitsByYear.append(0.0)
             self.BaseCostByYear.append(0.0)
 
+        # heating degree-hours (for hours when heating), and the date, of each hour in the period
+        hours = self.t_Hours[self.t_Start:self.t_End]
+        temp = self.T_Outdoor[self.t_Start:self.t_End]
+        heatingHours = np.flatnonzero(self.seasonMasks()[2][self.t_Start:self.t_End])
+        deltaT = self.WinterHPSetPoint - temp[heatingHours]
+        heatingDays = hours[heatingHours].astype('datetime64[D]')
+        purchaseDays = np.array(self.purchase_Date, dtype='datetime64[D]')
+
         # Calculate total annual delta T
-        delta_T = 0.0
-        for t in range(self.t_Start,self.t_End) :
-            if self.isHeating(t):
-                delta_T = delta_T + (self.WinterHPSetPoint - self.T_Outdoor[t])
+        delta_T = deltaT.sum()
 
         # Calculate the total oil used
         total_Vol = 0.0
@@ -1169,11 +1217,14 @@ class HeatPumpAnalysis :
                 self.BaseCostByYear[Y] += self.purchase_Cost[p]*(Quantity_Used/self.purchase_Quantity[p])
 
         # Calculate the average resistance per heating period
+        # Heating hours from the purchase date through the next one count towards that period; the first heating hour after
+        # it (up to the last purchase date) starts the next period, one period per hour (so periods without heating hours
+        # are passed over one hour at a time), and is counted with the quantity of the period before
         p = 0
         self.approx_Resistance[0][0] = self.t_Start
         self.approx_Resistance[0][1] = 0.0
-        for t in range(self.t_Start,self.t_End):
-        
+        i = 0
+        while p<self.last_Purchase and i<len(heatingHours):
             if self.BaseHeatType == self.WaterHeatType and self.WaterHeatMonthlyUsage>0 and p<len(self.purchase_Date)-2 :
                 purchasePeriod = (self.purchase_Date[p+1] - self.purchase_Date[p])
                 days = purchasePeriod.days
@@ -1182,23 +1233,19 @@ class HeatPumpAnalysis :
             else:
                 WaterFuelInPeriod = 0.
             Quantity_Used = (self.purchase_Quantity[p]-WaterFuelInPeriod)
+            units = self.BaseHvacEfficiency * Quantity_Used * self.BaseEnergyContent
 
-            ti = t-self.t_Start
-            dateTime = self.t_Data[t]
-            year = dateTime.year
-            Y = year - startYear
-        
-            thisDate = self.t_Data[t].date()
-            if self.isHeating(t) and (self.purchase_Date[p] <= thisDate) and (thisDate <= self.purchase_Date[p + 1]) and (p<self.last_Purchase):
+            # Sum app eligible delta_T during each heating period
+            j = max(i, np.searchsorted(heatingDays, purchaseDays[p+1], side='right'))
+            self.approx_Resistance[p][1] += (deltaT[i:j] / units).sum()
+            if j==len(heatingHours) or heatingDays[j] > purchaseDays[self.last_Purchase]:
+                break
 
-                # Sum app eligible delta_T during each heating period
-                self.approx_Resistance[p][1] += (self.WinterHPSetPoint - self.T_Outdoor[t]) / (self.BaseHvacEfficiency * Quantity_Used * self.BaseEnergyContent)
-            else:
-                if self.isHeating(t) and (self.purchase_Date[p + 1] <= thisDate) and (thisDate <= self.purchase_Date[self.last_Purchase]) and (p < self.last_Purchase): 
-                # this particular time sample belongs to the next purchase period
-                    p = p + 1
-                    self.approx_Resistance[p][0] = t
-                    self.approx_Resistance[p][1] =  (self.WinterHPSetPoint - self.T_Outdoor[t]) / (self.BaseHvacEfficiency * Quantity_Used * self.BaseEnergyContent)
+            # this particular time sample belongs to the next purchase period
+            p = p + 1
+            self.approx_Resistance[p][0] = self.t_Start + heatingHours[j]
+            self.approx_Resistance[p][1] = deltaT[j] / units
+            i = j + 1
  
     # Average resistance during the heating period
         self.average_Resistance = delta_T / (self.BaseHvacEfficiency * self.BaseEnergyContent * total_Vol)
@@ -1212,6 +1259,19 @@ class HeatPumpAnalysis :
 #        debugMessage = "total_Vol = %f" % total_Vol
 #        print(debugMessage)
         
+    def hourYear(self, t):
+        # year of hour t of the loaded temperature data
+        return int(self.t_Hours[t].astype('datetime64[Y]').astype(int)) + 1970
+
+    def hourIndex(self, day, start=0):
+        # index of the first hour of the loaded temperature data on a date, at or after index start (None if there is none)
+        # from the day index made when the data is loaded
+        if day not in self.t_DayIndex:
+            return None
+        first, last = self.t_DayIndex[day]
+        if start>last:
+            return None
+        return max(first, start)
 
     def heatPumpPerformance(self,h):
     #Author: Jonah Kadoko
@@ -1220,197 +1280,452 @@ class HeatPumpAnalysis :
 
 # argument h: 0 - analyze data for the years provided
 #             other - analyze performance for year h
+
+# The whole hourly series is evaluated at once with numpy arrays, giving the same yearly totals
+# as the original hour by hour loop (including its quirks, noted below)
+# With useBinMethod, hours are grouped into temperature bins and each bin is evaluated once (see binHours)
         use_Average_R = True
     
         p = 0
     
-        self.KWhByYear.clear()
-        self.HPAC_KWhByYear.clear()
-        self.BLAC_KWhByYear.clear()
-        self.SuppUnitsByYear.clear()
-        self.SuppUsesByYear.clear()
-
         if h==0:
-            startYear = self.t_Data[self.t_Start].year
-            endYear = self.t_Data[self.t_End].year
-        
-            self.timeArray = [self.t_Data[t] for t in range(self.t_Start,self.t_End)]
-            self.Q_required = [0.0 for t in range(self.t_Start, self.t_End)]
-            self.QC_required = [0.0 for t in range(self.t_Start, self.t_End)]
-            self.capacity_Max = [-1.0 for t in range(self.t_Start,self.t_End)]
-            self.capacity_Min = [0.0 for t in range(self.t_Start,self.t_End)]
-            self.electric_Required = [0.0 for t in range(self.t_Start,self.t_End)]
-            self.supplemental_Heat = [0.0 for t in range(self.t_Start,self.t_End)]
-            self.COP_Ave = [0.0 for t in range(self.t_Start,self.t_End)]
+            start = self.t_Start
+            end = self.t_End
+            startYear = self.hourYear(self.t_Start)
         else:
-
-            startYear = endYear = h
-            self.t_Start = 0
-            self.t_End = len(self.t_Data)
-
-            self.timeArray1 = [self.t_Data[t] for t in range(self.t_Start,self.t_End)]
-            self.Q_required1 = [0.0 for t in range(self.t_Start, self.t_End)]
-            self.QC_required1 = [0.0 for t in range(self.t_Start, self.t_End)]
-            self.capacity_Max1 = [-1.0 for t in range(self.t_Start,self.t_End)]
-            self.capacity_Min1 = [0.0 for t in range(self.t_Start,self.t_End)]
-            self.electric_Required1 = [0.0 for t in range(self.t_Start,self.t_End)]
-            self.supplemental_Heat1 = [0.0 for t in range(self.t_Start,self.t_End)]
-            self.COP_Ave1 = [0.0 for t in range(self.t_Start,self.t_End)]
+            # the whole of the series loaded for year h (the analysis period, t_Start-t_End, is kept)
+            startYear = h
+            start = 0
+            end = len(self.t_Hours)
 
             self.BaseUnitsByYear[0] = 0.
             self.BaseCostByYear[0] = 0.
- 
-        supplementalLastDate = self.t_Data[0]   # for determining how many supplemental days there are
-        oldYear = 1900
 
-        self.totalRequiredHeating = 0.
-        self.totalRequiredCooling = 0.
-    
-        for t in range(self.t_Start,self.t_End):
-            ti = t-self.t_Start
-            if h==0:
-                dateTime = self.timeArray[ti]
-            else:
-                dateTime = self.timeArray1[ti]
-            
-            year = dateTime.year
-            Y = year - startYear
-        
-            if year > oldYear:
-                oldYear = year
-                self.KWhByYear.append(0.0)
-                self.SuppUnitsByYear.append(0.0)
-                self.SuppUsesByYear.append(0)
-                self.BLAC_KWhByYear.append(0.0)
-                self.HPAC_KWhByYear.append(0.0)
-           
-            # Calculate the perfomance
-            if (use_Average_R) : 
-                resistance = self.average_Resistance            
-            else :
-                resistance = self.approx_Resistance[p][1]
+        timeArray = hours = self.t_Hours[start:end]
+        temp = self.T_Outdoor[start:end]
+        nHours = len(hours)
 
-            temp = self.T_Outdoor[t]
-            CAP_Max = 0
-            CAP_Min = 0  
-            COP_Min = []
-            COP_Max = []
-            np = len(self.HPChoice)
+        # index into the per-year lists for each hour
+        Y = hours.astype('datetime64[Y]').astype(int) + 1970 - startYear
+        nYears = Y[-1]+1 if nHours>0 else 0
 
+        # Calculate the perfomance
+        if (use_Average_R) : 
+            resistance = self.average_Resistance            
+        else :
+            resistance = self.approx_Resistance[p][1]
+
+        # the heating and cooling requirements are kept for the next analysis of the same hours and settings
+        demandKey = (self.t_Years, start, end, self.turn_ON_Date, self.turn_OFF_Date, self.WinterHPSetPoint, self.SummerHPSetPoint, resistance)
+        if demandKey in self.demandCache:
+            self.count("demand cache hits")
+        else:
+            if len(self.demandCache) >= 2*SERIES_CACHE_SIZE:
+                del self.demandCache[next(iter(self.demandCache))]
+            mode, loadTemp = self.demandState(start, end)
+            self.demandCache[demandKey] = (mode, loadTemp) + self.demand(mode, loadTemp, resistance)
+        mode, loadTemp, hourly_heating_required, hourly_cooling_required = self.demandCache[demandKey]
+
+        belowNABL = np.ones(nHours, dtype=bool) if len(self.HPChoice)==0 else temp<self.SuppOutdoorTempNABL
+
+        self.count("hours simulated", nHours)
+        if self.useBinMethod and use_Average_R:
+            # each bin evaluated once, weighted by the number of hours in it
+            # except hours beyond the heat pumps' capacity: their supplemental heat (the excess over capacity) is not linear
+            # in the requirement and temperature, so these are evaluated hour by hour, after the bins (as bins of one hour)
+            index = self.t_TempIndex[start:end]
+            CAP_Max = np.zeros(nHours)
             for hp in self.HPChoice:
-                CAP_Max += hp.MaxCapacity(temp)
-                CAP_Min += hp.MinCapacity(temp)
-            
-                COP_Min.append(hp.COPatMinCapacity(temp))
-                COP_Max.append(hp.COPatMaxCapacity(temp))
-
-            if self.isHeating(t):
-                heating_required = (self.WinterHPSetPoint - temp)/ resistance
-                cooling_required = 0.            
-            elif self.isCooling(t):
-                heating_required = 0.
-                cooling_required = (temp - self.SummerHPSetPoint)/ resistance
-
-            if h==0:
-                self.Q_required[ti] = heating_required
-                self.QC_required[ti]= cooling_required
-                self.capacity_Max[ti] = CAP_Max
-                self.capacity_Min[ti] = CAP_Min
-            
-            self.totalRequiredHeating += heating_required
-            self.totalRequiredCooling += cooling_required
+                CAP_Max += self.seriesPerformance(hp)[0, index]
+            single = ~belowNABL & (hourly_heating_required > CAP_Max)
+            binned = ~single
+            bins = self.binHours(Y[binned], temp[binned], mode[binned], loadTemp[binned], belowNABL[binned])
+            binY, binTemp, binMode, binLoadTemp, binBelowNABL, weight, binInverse, tempBin, tempBinMean = bins
+            nSingle = np.count_nonzero(single)
+            self.count("bins simulated", len(weight) + nSingle)
+
+            singleCapacity = np.zeros((4, nSingle))
+            for hp in self.HPChoice:
+                singleCapacity += self.seriesPerformance(hp)[:, index[single]]
+            capacity = [np.concatenate((c[tempBin], s)) for c, s in zip(self.heatPumpCapacity(tempBinMean), singleCapacity)]
+            heating_required, cooling_required = self.demand(binMode, binLoadTemp, resistance)
+            heating_required = np.concatenate((heating_required, hourly_heating_required[single]))
+            cooling_required = np.concatenate((cooling_required, hourly_cooling_required[single]))
+            weight = np.concatenate((weight, np.ones(nSingle)))
+            Yw = np.concatenate((binY, Y[single]))
+            inverse = np.empty(nHours, dtype=np.int64)
+            inverse[binned] = binInverse
+            inverse[single] = len(binY) + np.arange(nSingle)
+            response = self.heatPumpResponse(heating_required, capacity, np.concatenate((binBelowNABL, belowNABL[single])))
+        else:
+            weight = np.ones(nHours)
+            capacity = self.seriesCapacity(start, end)
+            heating_required, cooling_required = hourly_heating_required, hourly_cooling_required
+            response = self.heatPumpResponse(heating_required, capacity, belowNABL)
+            Yw = Y
+        supplemental_Heat, electric_Required, COP_Ave, needsSupp, usesHP = response
 
-            COPave = 0.0        
-                        
-        # calculate the average values of the above
-        # Linear interpolation, doesn't work well
-        # COP_Ave(t, h) = (Q_required(t) - capacity_Min(t, h)) * (COP_Max - COP_Min) / (capacity_Max(t, h) - capacity_Min(t, h)) + COP_Min          
-        # Weighted average works better
-#        c = (abs(Q_required[t] - capacity_Min[t]) * COP_Min + abs(Q_required[t] - capacity_Max[t]) * COP_Max)
+        self.totalRequiredHeating = (weight*heating_required).sum()
+        self.totalRequiredCooling = (weight*cooling_required).sum()
+
+        KWhByYear = np.zeros(nYears)
+        SuppUnitsByYear = np.zeros(nYears)
+        BLAC_KWhByYear = np.zeros(nYears)
+        HPAC_KWhByYear = np.zeros(nYears)
 
         # for years with purchase data - use purchase data for baseline units and cost
         # for analysis of average and extreme, back-calculate what we would have used
-            if h!= 0:
-                self.BaseUnitsByYear[Y] += heating_required/self.BaseHvacEfficiency/self.BaseEnergyContent
-                self.BaseCostByYear[Y] += self.BaseCostPerUnit*heating_required/self.BaseHvacEfficiency/self.BaseEnergyContent
-        
-            # Note times where the heat pump cannot meet demand
-            if len(self.HPChoice)==0 or temp<self.SuppOutdoorTempNABL:
-
-                supplemental_required = heating_required
-            
-                if h==0:
-                    self.supplemental_Heat[ti] = supplemental_required
-
-                self.SuppUnitsByYear[Y] += supplemental_required/self.SuppHvacEfficiency/self.SuppEnergyContent
-
-                # is this a new supplemental usage (within 24 hours of the past one)
-                deltaTime = dateTime - supplementalLastDate
-                if deltaTime>datetime.timedelta(1,0)  : #timeDelta(0,0,1,0,0)
-                    supplementalLastDate = dateTime
-                    self.SuppUsesByYear[Y] += 1
-
-            elif (heating_required > CAP_Max) :
-                for i in range(np): 
-                    COPave += COP_Max[i]/np
-                
-                supplemental_required = heating_required - CAP_Max
-            
-                if h==0:
-                    self.supplemental_Heat[ti] = supplemental_required
+        if h!= 0:
+            baseUnits = weight*heating_required/self.BaseHvacEfficiency/self.BaseEnergyContent
+            BaseUnitsByYear = np.zeros(nYears)
+            np.add.at(BaseUnitsByYear, Yw, baseUnits)
+            BaseCostByYear = np.zeros(nYears)
+            np.add.at(BaseCostByYear, Yw, self.BaseCostPerUnit*baseUnits)
+            for y in range(nYears):
+                self.BaseUnitsByYear[y] += BaseUnitsByYear[y]
+                self.BaseCostByYear[y] += BaseCostByYear[y]
+
+        np.add.at(SuppUnitsByYear, Yw[needsSupp], weight[needsSupp]*supplemental_Heat[needsSupp]/self.SuppHvacEfficiency/self.SuppEnergyContent)
+        np.add.at(KWhByYear, Yw[usesHP], weight[usesHP]*electric_Required[usesHP])
+
+        if self.BaselineAC != 0 and self.BaselineSEER>0:
+            np.add.at(BLAC_KWhByYear, Yw, weight*cooling_required / self.BaselineSEER/1000.)
+
+        coolingHours = cooling_required > 0
+        if len(self.HPChoice)>0 and coolingHours.any() :
+            # weighted average SEER based on fraction of total capacity at 47 degrees
+            HPSEER = 0.
+            CAPTOTAL = 0.
+            for hp in self.HPChoice:
+                HPSEER += float(hp.SEER) * hp.MaxCapacity(47)
+                CAPTOTAL += hp.MaxCapacity(47)
+            HPSEER = HPSEER/CAPTOTAL
+                 
+            if HPSEER>0.:
+                np.add.at(HPAC_KWhByYear, Yw[coolingHours], weight[coolingHours]*cooling_required[coolingHours] / HPSEER/1000.)
+
+        if self.useBinMethod and use_Average_R:
+            # back to hourly values, for counting supplemental uses and for the graph
+            heating_required = heating_required[inverse]
+            cooling_required = cooling_required[inverse]
+            capacity = [c[inverse] for c in capacity]
+            supplemental_Heat = supplemental_Heat[inverse]
+            electric_Required = electric_Required[inverse]
+            COP_Ave = COP_Ave[inverse]
+            needsSupp = needsSupp[inverse]
+
+        # is this a new supplemental usage (more than 24 hours after the last one counted)
+        SuppUsesByYear = np.zeros(nYears, dtype=int)
+        suppHours = hours[needsSupp].astype(np.int64)
+        suppY = Y[needsSupp]
+        lastHour = self.t_Hours[0].astype(np.int64)
+        i = np.searchsorted(suppHours, lastHour+24, side='right')
+        while i<len(suppHours):
+            SuppUsesByYear[suppY[i]] += 1
+            i = np.searchsorted(suppHours, suppHours[i]+24, side='right')
+
+        self.KWhByYear = KWhByYear.tolist()
+        self.SuppUnitsByYear = SuppUnitsByYear.tolist()
+        self.SuppUsesByYear = SuppUsesByYear.tolist()
+        self.BLAC_KWhByYear = BLAC_KWhByYear.tolist()
+        self.HPAC_KWhByYear = HPAC_KWhByYear.tolist()
+
+        # the hourly series kept (for the graph and exportHourly), as rows of one HOURLY_DTYPE array - for the analysis
+        # period, the same array each time while the number of hours is unchanged; for a single year, a new one each
+        # time, as yearPerformance keeps them
+        CAP_Max, CAP_Min = capacity[0], capacity[1]
+        series = (heating_required, cooling_required, CAP_Max, CAP_Min, electric_Required, supplemental_Heat, COP_Ave)
+        if h==0:
+            if self.hourlyBuffer is None or self.hourlyBuffer.shape[1] != nHours:
+                self.hourlyBuffer = np.empty((len(HOURLY_SERIES), nHours), dtype=HOURLY_DTYPE)
+            hourly = self.hourlyBuffer
+            suffix = ''
+        else:
+            hourly = np.empty((len(HOURLY_SERIES), nHours), dtype=HOURLY_DTYPE)
+            suffix = '1'
+        setattr(self, 'timeArray'+suffix, timeArray.view(np.int64))
+        for name, row, values in zip(HOURLY_SERIES, hourly, series):
+            row[:] = values
+            setattr(self, name+suffix, row)
+
+    def yearPerformance(self, status, year):
+        # heatPumpPerformance(year) for the climate of that year, or its results from the last time with the same inputs
+        key = (year, self.climate.station, self.average_Resistance, self.WinterHPSetPoint, self.SummerHPSetPoint, 
+               self.turn_ON_Date, self.turn_OFF_Date, tuple(hp.AHRICertNumber for hp in self.HPChoice), 
+               self.SuppOutdoorTempNABL, self.SuppHvacEfficiency, self.SuppEnergyContent, 
+               self.BaseHvacEfficiency, self.BaseEnergyContent, self.BaseCostPerUnit, self.BaselineAC, self.BaselineSEER, self.useBinMethod)
+        if key in self.yearCache:
+            self.count("year cache hits")
+            self.yearCache.move_to_end(key)
+            results = self.yearCache[key]
+            for name in YEAR_RESULTS:
+                setattr(self, name, results[name])
+            self.BaseUnitsByYear[0], self.BaseCostByYear[0] = results['Base']
+            return
 
-                self.SuppUnitsByYear[Y] += supplemental_required/self.SuppHvacEfficiency/self.SuppEnergyContent
-            
-                
-                # is this a new supplemental usage (within 24 hours of the past one)
-                deltaTime = dateTime - supplementalLastDate
-                if deltaTime>datetime.timedelta(1,0)  : #timeDelta(0,0,1,0,0)
-                    supplementalLastDate = dateTime
-                    self.SuppUsesByYear[Y] += 1
-                
-                # The amount of electricity required to heat the area with Q_required BTUs
-                electric_required = CAP_Max / COPave/ENERGY_CONTENT_ELEC
-            
-                if h==0:
-                    self.electric_Required[ti] = electric_required
-                
-                self.KWhByYear[Y] += electric_required
+        self.LoadTempDataRaw(status,year)
+        self.heatPumpPerformance(year)
+
+        results = dict((name, getattr(self, name)) for name in YEAR_RESULTS)
+        results['Base'] = (self.BaseUnitsByYear[0], self.BaseCostByYear[0])
+        self.yearCache[key] = results
+        if len(self.yearCache) > YEAR_CACHE_SIZE:
+            self.yearCache.popitem(last=False)
+
+    def demandState(self, start=0, end=None):
+        # for each hour from start to end, whether there is a heating (1) or cooling (-1) requirement, and the outdoor temperature it is based on
+        # in hours which are neither heating nor cooling, the hourly loop left the previous hour's heating and cooling
+        # requirements in place - keep that behaviour (hours before the first heating or cooling hour have no requirement)
+        heatingYear, inSeason, heating, cooling = self.seasonMasks()
+        heating = heating[start:end]
+        cooling = cooling[start:end]
+        temp = self.T_Outdoor[start:end]
+        last = np.where(heating | cooling, np.arange(len(temp)), -1)
+        if len(last)>0:
+            last = np.maximum.accumulate(last)
+        mode = np.where(heating, 1, np.where(cooling, -1, 0))[np.maximum(last,0)]
+        mode[last<0] = 0
+        loadTemp = temp[np.maximum(last,0)]
+        return mode, loadTemp
+
+    def demand(self, mode, loadTemp, resistance):
+        # heating and cooling requirements (BTU/hr) from demandState
+        heating_required = np.where(mode==1, (self.WinterHPSetPoint - loadTemp)/resistance, 0.)
+        cooling_required = np.where(mode==-1, (loadTemp - self.SummerHPSetPoint)/resistance, 0.)
+        return heating_required, cooling_required
+
+    def binHours(self, Y, temp, mode, loadTemp, belowNABL, binWidth=1.0):
+        # Temperature bin method: with a constant resistance, the result for an hour depends only on its year, its
+        # outdoor temperature (heat pump capacity and COP), and the heating/cooling requirement (mode and load temperature,
+        # which differ from the hour's own only in hours carrying over the previous requirement)
+        # Hours are grouped by year, binWidth deg F temperature bins and requirement; returns per bin: year, mean temperature,
+        # mode, mean load temperature, whether below the supplemental enable temperature, number of hours, and for each hour
+        # its bin (to recover hourly values), plus the index of each bin's temperature bin and the mean temperature of those,
+        # at which the heat pumps are evaluated (100-200 temperatures in all, rather than once per hour)
+        tempBins, tempBin = np.unique(np.floor(temp/binWidth).astype(np.int64), return_inverse=True)
+        loadBins, loadBin = np.unique(np.floor(loadTemp/binWidth).astype(np.int64), return_inverse=True)
+        tempBin = tempBin.reshape(-1)
+        loadBin = loadBin.reshape(-1)
+
+        # a single integer key for each hour (faster to sort than rows of keys)
+        keys = (((Y.astype(np.int64)*len(tempBins) + tempBin)*len(loadBins) + loadBin)*3 + mode+1)*2 + belowNABL
+        binKeys, inverse, weight = np.unique(keys, return_inverse=True, return_counts=True)
+        inverse = inverse.reshape(-1)
+        binBelowNABL = (binKeys % 2).astype(bool)
+        binMode = (binKeys//2) % 3 - 1
+        binTempBin = (binKeys//(2*3*len(loadBins))) % len(tempBins)
+        binY = binKeys//(2*3*len(loadBins)*len(tempBins))
+
+        weight = weight.astype(float)
+        binTemp = np.bincount(inverse, weights=temp)/weight
+        binLoadTemp = np.bincount(inverse, weights=loadTemp)/weight
+        tempBinMean = np.bincount(tempBin, weights=temp)/np.bincount(tempBin)
+        return binY, binTemp, binMode, binLoadTemp, binBelowNABL, weight, inverse, binTempBin, tempBinMean
+
+    def heatPumpResponse(self, heating_required, capacity, belowNABL, nhp=None):
+        # supplemental heat, electricity and average COP for each heating requirement (array), given the combined
+        # capacity and COP of the heat pumps (from heatPumpCapacity) at that time
+        # also returns masks of the times needing supplemental heat and the times using the heat pumps
+        # nhp is the number of heat pumps (the chosen ones by default); arrays may also be 2-D, one row per
+        # heat pump system with nhp a column of the number in each (see rankHeatPumps)
+        CAP_Max, CAP_Min, COP_Min, COP_Max = capacity
+        if nhp is None:
+            nhp = len(self.HPChoice)
+
+        # Note times where the heat pump cannot meet demand
+        overCapacity = ~belowNABL & (heating_required > CAP_Max)
+        onlyHP = ~belowNABL & ~overCapacity
+        needsSupp = belowNABL | overCapacity
+        usesHP = overCapacity | onlyHP
         
-            else:
-                if (heating_required < CAP_Min):
-                    for i in range(np):                
-                        COPave += COP_Min[i]/np
-            
-                else:
-                    #Linear interpolation, doesn't work well
-                    #COP_Ave[t] = ((abs(Q_required[t] - capacity_Min[t]) * COP_Min + \
-                    #    abs(Q_required[t] - capacity_Max[t]) * COP_Max)) / abs(capacity_Max[t] - capacity_Min[t]) 
-                    for i in range(np):                
-                        COPave += COP_Min[i] + ((heating_required - CAP_Min) * (COP_Max[i] - COP_Min[i])) / (CAP_Max - CAP_Min) /np
-                
-                # The amount of electricity required to heat the area with Q_required BTUs
-                electric_required = heating_required / COPave /ENERGY_CONTENT_ELEC     
-                self.KWhByYear[Y] += electric_required
-                if h==0:
-                    self.electric_Required[ti] = electric_required
-                
-            if self.BaselineAC != 0 and self.BaselineSEER>0:
-                self.BLAC_KWhByYear[Y] += cooling_required / self.BaselineSEER/1000.
+        supplemental_Heat = np.where(belowNABL, heating_required, np.where(overCapacity, heating_required - CAP_Max, 0.))
 
-            if len(self.HPChoice)>0 and cooling_required > 0 :
-                # weighted average SEER based on fraction of total capacity at 47 degrees
+        # calculate the average values of the above
+        # Linear interpolation, doesn't work well
+        # COP_Ave(t, h) = (Q_required(t) - capacity_Min(t, h)) * (COP_Max - COP_Min) / (capacity_Max(t, h) - capacity_Min(t, h)) + COP_Min          
+        # Weighted average works better
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # as in the original loop, only the interpolated term is divided by the number of heat pumps
+            COP_Ave = np.where(overCapacity, COP_Max/nhp, 
+                      np.where(onlyHP & (heating_required < CAP_Min), COP_Min/nhp, 
+                      np.where(onlyHP, COP_Min + ((heating_required - CAP_Min) * (COP_Max - COP_Min)) / (CAP_Max - CAP_Min) /nhp, 0.)))
+
+            # The amount of electricity required to heat the area with Q_required BTUs
+            electric_Required = np.where(overCapacity, CAP_Max / COP_Ave /ENERGY_CONTENT_ELEC, 
+                                np.where(onlyHP, heating_required / COP_Ave /ENERGY_CONTENT_ELEC, 0.))
+
+        return supplemental_Heat, electric_Required, COP_Ave, needsSupp, usesHP
+
+    def compareBinMethod(self, h=0):
+        # parity check of the bin method against the hourly simulation, for the analysis period or year h
+        # (after approxResistance): returns the largest relative difference in the yearly results
+        self.LoadTempDataRaw(None, h)
+        useBinMethod = self.useBinMethod
+        byYear = ('KWhByYear', 'SuppUnitsByYear', 'BLAC_KWhByYear', 'HPAC_KWhByYear')
+        results = []
+        for self.useBinMethod in (False, True):
+            self.heatPumpPerformance(h)
+            results.append([np.array(getattr(self, name)) for name in byYear])
+        self.useBinMethod = useBinMethod
+
+        difference = 0.
+        for hourly, binned in zip(*results):
+            if len(hourly)>0:
+                difference = max(difference, np.max(np.abs(binned-hourly)/np.maximum(np.abs(hourly),1.)))
+        return difference
+
+    def checkBinMethod(self, tolerance=BIN_TOLERANCE):
+        # compareBinMethod for the analysis period and the average heating year, raising ValueError if either differs
+        # by more than tolerance; returns the larger difference
+        difference = max(self.compareBinMethod(h) for h in (0, self.typicalYears()[0]))
+        if difference > tolerance:
+            raise ValueError("bin method differs from the hourly simulation by %.2e (tolerance %.0e)" % (difference, tolerance))
+        return difference
+
+    def rankHeatPumps(self, rankBy='cost', maxUnits=1, mixed=False, systems=None, year=None, status=None):
+        # Score every heat pump in HPList against this home (thermal resistance from the last analysis or approxResistance),
+        # for the climate of one year (the average heating year by default), ranked by annual cost, supplemental fraction or CO2
+        # (rankBy: one of RANK_BY)
+        # maxUnits: also consider systems of 2..maxUnits of the same heat pump, or with mixed=True all combinations of up to
+        # maxUnits heat pumps (many: for 440 listings, about 97000 pairs)
+        # systems: alternatively, the list of systems (each a list of heat pumps) to rank
+        # Returns a list of dictionaries, best first, with the heat pumps in each system and its annual KWh (heating and
+        # cooling), supplemental units, cost, supplemental fraction of the heating load and kg CO2
+        if rankBy not in RANK_BY:
+            raise ValueError("rankBy must be one of: "+", ".join(RANK_BY))
+        if self.average_Resistance <= 0:
+            raise ValueError("no thermal resistance for this home - analyze the fuel deliveries first")
+
+        if year is None:
+            year = self.typicalYears(status)[0]
+        if systems is None:
+            if self.catalog is None:
+                self.loadHeatPumps()
+            systems = []
+            for n in range(1,maxUnits+1):
+                if mixed:
+                    systems += [list(c) for c in itertools.combinations_with_replacement(self.HPList, n)]
+                else:
+                    systems += [[hp]*n for hp in self.HPList]
+
+        # prices as for the average and coldest years of the analysis
+        self.UpdatePrices()
+        self.LoadTempDataRaw(status,year)
+
+        hours = self.t_Hours
+        mode, loadTemp = self.demandState()
+        heating_required, cooling_required = self.demand(mode, loadTemp, self.average_Resistance)
+        inYear = hours.astype('datetime64[Y]').astype(int) + 1970 == year
+        totalRequiredHeating = heating_required[inYear].sum()
+        totalRequiredCooling = cooling_required[inYear].sum()
+
+        # Each hour's result depends only on its outdoor temperature and heating requirement, so evaluate each distinct pair
+        # once, weighted by the number of hours in the year with it (a few thousand, rather than 8760)
+        temps = self.t_TempValues
+        tempIndex = self.t_TempIndex
+        states, stateIndex, weight = np.unique(np.stack([tempIndex[inYear], heating_required[inYear]], axis=1), axis=0,
+                                               return_inverse=True, return_counts=True)
+        stateTemp = states[:,0].astype(int)
+        stateRequired = states[:,1]
+        stateBelowNABL = temps[stateTemp] < self.SuppOutdoorTempNABL
+
+        # performance of each heat pump at each distinct temperature
+        performance = {}
+        for hp in set(hp for system in systems for hp in system):
+            performance[hp] = self.seriesPerformance(hp)
+
+        candidates = []
+        chunk = 64      # systems evaluated at once, as a (system x hour) array
+        for first in range(0, len(systems), chunk):
+            self.showStatus(status, "Ranking heat pumps: %d of %d" % (first, len(systems)), first/len(systems))
+            batch = systems[first:first+chunk]
+            capacity = np.array([np.sum([performance[hp] for hp in system], axis=0) for system in batch])[:,:,stateTemp]
+            nhp = np.array([len(system) for system in batch])[:,np.newaxis]
+
+            supplemental_Heat, electric_Required, COP_Ave, needsSupp, usesHP = self.heatPumpResponse(stateRequired, 
+                capacity.transpose(1,0,2), stateBelowNABL, nhp)
+            KWh = (electric_Required*weight).sum(axis=1)
+            SuppUnits = (supplemental_Heat*weight).sum(axis=1)/self.SuppHvacEfficiency/self.SuppEnergyContent
+
+            for system, kwh, suppUnits in zip(batch, KWh, SuppUnits):
+                # weighted average SEER based on fraction of total capacity at 47 degrees, as in heatPumpPerformance
                 HPSEER = 0.
                 CAPTOTAL = 0.
-                for hp in self.HPChoice:
+                for hp in system:
                     HPSEER += float(hp.SEER) * hp.MaxCapacity(47)
                     CAPTOTAL += hp.MaxCapacity(47)
                 HPSEER = HPSEER/CAPTOTAL
-                 
                 if HPSEER>0.:
-                    self.HPAC_KWhByYear[Y] += cooling_required / HPSEER/1000.
+                    kwh += totalRequiredCooling/HPSEER/1000.
+
+                candidates.append({'HeatPumps':system,
+                                   'Name':"+".join(hp.Brand +'-' +hp.OutdoorUnit for hp in system),
+                                   'KWh':kwh,
+                                   'SuppUnits':suppUnits,
+                                   'Cost':kwh*self.STANDARD_PRICE_ELEC + suppUnits*self.SuppCostPerUnit,
+                                   'SuppFraction':suppUnits*self.SuppEnergyContent/totalRequiredHeating,
+                                   'KgCO2':kwh*self.ElecKgCO2PerUnit + suppUnits*self.SuppKgCO2PerUnit})
+
+        self.showStatus(status, "Ranked %d heat pump systems" % len(candidates), 1.)
+        candidates.sort(key=lambda candidate: candidate[RANK_BY[rankBy]])
+        return candidates
+
+    def seriesCapacity(self, start=0, end=None):
+        # heatPumpCapacity for the hours start-end of the loaded series, from the performance of each heat pump at the
+        # distinct temperatures of the series (kept, so that only a newly chosen heat pump need be evaluated)
+        index = self.t_TempIndex[start:end]
+        capacity = np.zeros((4, len(index)))
+        for hp in self.HPChoice:
+            capacity += self.seriesPerformance(hp)[:, index]
+        return tuple(capacity)
+
+    def seriesPerformance(self, hp):
+        # maximum and minimum capacity, COP at minimum and maximum capacity of a heat pump at t_TempValues
+        key = (hp, self.t_Years)
+        if key in self.performanceCache:
+            self.count("performance cache hits")
+        else:
+            self.performanceCache[key] = np.array(hp.performance(self.t_TempValues))
+        return self.performanceCache[key]
+
+    def resistanceInputs(self):
+        # everything approxResistance depends on, to tell when it must be recalculated
+        return (self.t_Years, tuple(self.purchase_Date), tuple(self.purchase_Quantity), tuple(self.purchase_Cost), 
+                self.numDeliveries, self.BaseHeatType, self.BaseHvacEfficiency, self.BaseEnergyContent, 
+                self.WaterHeatType, self.WaterHeatMonthlyUsage, self.WinterHPSetPoint, self.turn_ON_Date, self.turn_OFF_Date)
+
+    def heatPumpCapacity(self, temp, heatPumps=None):
+        # combined maximum and minimum capacity, and summed COP at min and max capacity, of the chosen heat pumps
+        # (or the list heatPumps) for an array of outdoor temperatures
+        if heatPumps is None:
+            heatPumps = self.HPChoice
+        CAP_Max = np.zeros(len(temp))
+        CAP_Min = np.zeros(len(temp))
+        COP_Min = np.zeros(len(temp))
+        COP_Max = np.zeros(len(temp))
+        for hp in heatPumps:
+            capMax, capMin, copMin, copMax = hp.performance(temp)
+            CAP_Max += capMax
+            CAP_Min += capMin
+            COP_Min += copMin
+            COP_Max += copMax
+        return CAP_Max, CAP_Min, COP_Min, COP_Max
                                     
+    def exportHourly(self, filename, typicalYear=False, compress=False, chunkHours=HOURLY_CHUNK):
+        # write the hourly series of the last analysis (typicalYear: of the last average or coldest year analyzed) as
+        # columns, an .npz or .csv file (see AnalysisResults.writeHourly), to be read without redoing the analysis
+        suffix = '1' if typicalYear else ''
+        hours = getattr(self, 'timeArray'+suffix, [])
+        if len(hours)==0:
+            raise ValueError("No hourly results to export - do the analysis first")
+        columns = OrderedDict((name, getattr(self, name+suffix)) for name in HOURLY_SERIES)
+        info = OrderedDict([('deliveries', self.deliveriesFile), ('station', self.climate.station),
+                            ('heatPumps', [hp.AHRICertNumber for hp in self.HPChoice]), 
+                            ('resistance', self.average_Resistance), ('series', HOURLY_SERIES)])
+        writeHourly(filename, hours, columns, info, compress, chunkHours)
+
     def outputData(self,results):
-        # This routine outputs all results to a text file
+        # This routine outputs all results (AnalysisResults) to a text file
 
         now = datetime.date.today()
         now = now.isoformat()
@@ -1420,12 +1735,12 @@ class HeatPumpAnalysis :
             hpNames += hp.Brand +'-' +hp.OutdoorUnit 
 #            hpNames += hp.Manufacturer +'-' +hp.OutdoorUnit 
         
-        outputFile = './Output Data/Heat Pump Analysis-'+now+'.txt'
+        outputFile = self.workingDirectory + 'Output Data/Heat Pump Analysis-'+now+'.txt'
         #output = open(outputFile,'w')
         output = open(outputFile,'a')
            
         output.write('Analysis for: '+hpNames +'\r')    
  
-        output.write(results)
+        output.write(results.text())
         output.close()
     
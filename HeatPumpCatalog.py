@@ -0,0 +1,335 @@
+# Copyright (c) 2015 CSEC (Comprehensive Sustainable Energy Committee), Town of Concord
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# The NEEP cold climate heat pump listings (tab separated text or CSV exports of the spreadsheet), as one catalog
+#
+# Each listing is parsed once into columns - the descriptive fields as string arrays, and the capacity and COP
+# at minimum and maximum capacity at 47, 17, 5 deg F and the minimum operating temperature as (n,4) arrays -
+# and saved in an .npz file in a '.cache' directory beside it, rebuilt when the listing changes.
+# The layout of a listing is found from its headers (see listingLayout), so the different versions of the
+# listing can be read; several listings are merged, the first listing with an AHRI certificate number giving
+# the heat pump for it.  The HeatPump objects are made from the columns when first asked for.
+#
+# Indexes by manufacturer, brand, ductless or ducted, zones and capacity are built when the catalog is loaded,
+# so that select() and certificate() take time in proportion to the heat pumps found, not the catalog size.
+
+import os
+import re
+import csv
+
+import numpy as np
+
+from HeatPump import HeatPump
+
+CACHE_DIR = '.cache'
+CACHE_VERSION = 2
+
+# the descriptive fields (HeatPump attribute names), and the header of the column for each in the listings
+STRING_FIELDS = ('Manufacturer', 'Brand', 'ModelName', 'AHRICertNumber', 'OutdoorUnit', 'IndoorUnits', 'AHRIType',
+                 'HSPFregIV', 'SEER', 'EER_95', 'CoolingCapacity', 'EnergyStar', 'DuctedDuctless', 'Zones',
+                 'DuctlessIndoorType')
+FIELD_HEADERS = {'Manufacturer':r'^Manufacturer', 'Brand':r'^Brand', 'ModelName':r'^Model Name',
+                 'AHRICertNumber':r'^AHRI Certificate', 'OutdoorUnit':r'^Outdoor Unit', 'IndoorUnits':r'^Indoor Unit',
+                 'AHRIType':r'^AHRI Type', 'HSPFregIV':r'^HSPF', 'SEER':r'^SEER', 'EER_95':r'^EER',
+                 'CoolingCapacity':r'^Cooling Capacity', 'EnergyStar':r'^ENERGY STAR', 'DuctedDuctless':r'^Ductless or',
+                 'Zones':r'Single-zone', 'DuctlessIndoorType':r'^Ductless Indoor Type'}
+
+PERFORMANCE_FIELDS = ('CAPMin', 'CAPMax', 'COPMin', 'COPMax')
+RATED_TEMPERATURES = (47, 17, 5)
+
+# the string fields indexed, by the name used in select()
+INDEXED_FIELDS = {'manufacturer':'Manufacturer', 'brand':'Brand', 'zones':'Zones'}
+
+# the performance column headers: the test condition (47, 17, 5 deg F, or X for the optional fourth condition,
+# however the degree sign was exported), minimum or maximum, and capacity or COP
+CONDITION = re.compile(r'(?<![0-9A-Za-z])(47|17|5|X)[^0-9A-Za-z]{0,3}F\b')
+CONDITION_GROUP = re.compile(r'Condition ([1-4])')
+CONDITIONS = {'47':0, '17':1, '5':2, 'X':3, '1':0, '2':1, '3':2, '4':3}
+
+def listingValue(stringvar):
+    # a number from the listing: -1 for an empty cell, -99 for a spreadsheet division by zero
+    if len(stringvar)==0:
+        return -1.0
+    if stringvar=="#DIV/0!":
+        return -99.0
+    return float((stringvar.replace(',','')).replace('"',''))
+
+def readRows(filename):
+    # the cells of each row of a listing: CSV, or tab separated text (UTF-8, or the older exports' Latin-1)
+    try:
+        input = open(filename,'r', encoding='utf-8')
+        text = input.read()
+    except UnicodeDecodeError:
+        input = open(filename,'r', encoding='latin-1')
+        text = input.read()
+    input.close()
+
+    lines = text.split('\n')
+    if filename.lower().endswith('.csv'):
+        return list(csv.reader(lines))
+    return [line.split('\t') for line in lines]
+
+def headerLabel(cell):
+    return ' '.join(cell.replace('"','').split())
+
+def listingLayout(rows):
+    # the columns of a listing, found from its headers: (first data row, {field: column} for the string fields,
+    # {(performance field, condition): column}, [column of the temperature of the optional fourth condition])
+    # The header row starts 'Manufacturer'.  In some versions the row above it names the test conditions
+    # ('Condition 1 Performance - (47F/70F)', ...) and the row below it the minimum/rated/maximum columns,
+    # under 'Capacity (btu/hr)', 'COP' etc. headers; in others each header names all of these.
+    header = 0
+    while headerLabel(rows[header][0]) != 'Manufacturer':
+        header += 1
+        if header==len(rows):
+            raise ValueError("no 'Manufacturer' header row")
+    labels = [headerLabel(cell) for cell in rows[header]]
+
+    groups = ['']*len(labels)
+    if header > 0 and any(CONDITION_GROUP.search(cell) for cell in rows[header-1]):
+        group = ''
+        for column, cell in enumerate(rows[header-1][0:len(labels)]):
+            group = headerLabel(cell) or group
+            groups[column] = group
+
+    first = header+1
+    levels = ['']*len(labels)
+    if first < len(rows) and rows[first][0]=='' and 'Minimum' in rows[first]:
+        levels = [headerLabel(cell) for cell in rows[first][0:len(labels)]] + ['']*(len(labels)-len(rows[first]))
+        first += 1
+
+    fields = {}
+    performance = {}
+    tMinColumn = []
+    spanning = ''
+    for column in range(len(labels)):
+        # (a header over minimum/rated/maximum columns spans them)
+        spanning = labels[column] or spanning
+        label = spanning if levels[column] else labels[column]
+        text = label + ' ' + levels[column]
+        if not levels[column]:
+            for field, pattern in FIELD_HEADERS.items():
+                if field not in fields and re.search(pattern, label):
+                    fields[field] = column
+                    break
+        if label.startswith('Outdoor Dry Bulb'):
+            tMinColumn = [column]
+            continue
+        if 'Maintenance' in text or 'Input Power' in text:
+            continue
+
+        condition = CONDITION.search(text) or CONDITION.search(groups[column]) or CONDITION_GROUP.search(groups[column])
+        if condition is None:
+            continue
+        quantity = 'COP' if 'COP' in text else ('CAP' if 'Cap' in text else None)
+        level = 'Min' if re.search(r'\bMin', text) else ('Max' if re.search(r'\bMax', text) else None)
+        if quantity and level:
+            performance.setdefault((quantity+level, CONDITIONS[condition.group(1)]), column)
+
+    for name in ('Manufacturer', 'AHRICertNumber'):
+        if name not in fields:
+            raise ValueError("no '%s' column" % name)
+    for field in PERFORMANCE_FIELDS:
+        for condition in range(3):
+            if (field, condition) not in performance:
+                raise ValueError("no column for %s at %d F" % (field, RATED_TEMPERATURES[condition]))
+    return first, fields, performance, tMinColumn
+
+def parseListing(filename):
+    # the columns of a listing: each of STRING_FIELDS, tData (n,4) and each of PERFORMANCE_FIELDS (n,4), with nan
+    # in the fourth column where there is no minimum operating temperature; rows which can't be read are skipped
+    rows = readRows(filename)
+    first, fields, performance, tMinColumn = listingLayout(rows)
+    needed = max(performance[(field, condition)] for field in PERFORMANCE_FIELDS for condition in range(3)) + 1
+    C2 = tMinColumn[0] if tMinColumn else None
+
+    strings = []
+    numbers = []
+    for tokens in rows[first:]:
+        if tokens[0]=='':
+            break
+        if len(tokens) < needed:
+            continue
+
+        try:
+            # min capacity, max capacity, COP at min and COP at max capacity, at each rated temperature
+            row = [[listingValue(tokens[performance[(field, i)]]) for i in range(3)] for field in PERFORMANCE_FIELDS]
+
+            tMin = np.nan
+            extra = [np.nan]*4
+            if C2 is not None and C2 < len(tokens) and (len(tokens[C2])>0) & (tokens[C2] != 'N/A'):
+                tMin = listingValue(tokens[C2])
+                extra = [listingValue(tokens[performance[(field, 3)]]) for field in PERFORMANCE_FIELDS]
+                if extra[0] < 0. :
+                    extra[0] = extra[1]
+                    extra[2] = extra[3]
+        except Exception as e:
+            print(e)
+            continue
+
+        strings.append([tokens[fields[field]] if field in fields else '' for field in STRING_FIELDS])
+        numbers.append([list(RATED_TEMPERATURES)+[tMin]] + [values+[extra[i]] for i, values in enumerate(row)])
+
+    columns = {}
+    for i, field in enumerate(STRING_FIELDS):
+        columns[field] = np.array([row[i] for row in strings], dtype=str)
+    columns['AHRICertNumber'] = np.char.strip(columns['AHRICertNumber'])
+    columns['Brand'] = np.where(columns['Brand']=='', columns['Manufacturer'], columns['Brand'])   # older listings
+    numbers = np.array(numbers, dtype=float).reshape(-1, 1+len(PERFORMANCE_FIELDS), 4)
+    columns['tData'] = numbers[:,0]
+    for i, field in enumerate(PERFORMANCE_FIELDS):
+        columns[field] = numbers[:,i+1]
+    return columns
+
+def mergeColumns(listings):
+    # the columns of several listings as one, with the rows of AHRI certificate numbers found in an earlier listing
+    # left out; each listing's own rows are all kept (some certificates appear twice in a listing), so the rows of the
+    # first listing keep their positions (HPList indices)
+    seen = set()
+    keep = []
+    for columns in listings:
+        certs = columns['AHRICertNumber'].tolist()
+        keep.append(np.array([row for row, cert in enumerate(certs) if cert not in seen], dtype=np.intp))
+        seen.update(certs)
+    return dict((name, np.concatenate([columns[name][rows] for columns, rows in zip(listings, keep)]))
+                for name in listings[0])
+
+class HeatPumpCatalog :
+    """The heat pumps of one or more NEEP listings, in columns with indexes for selection"""
+    def __init__(self, filenames) :
+        # filenames: a listing, or a list of them (for a certificate number in more than one, the first is used)
+        if isinstance(filenames, str):
+            filenames = [filenames]
+        self.filenames = filenames
+        self.columns = mergeColumns([self.loadColumns(filename) for filename in filenames])
+        self.count = len(self.columns['AHRICertNumber'])
+        self.heatPumpList = [None]*self.count      # HeatPump objects, made when first used
+        self.buildIndexes()
+
+    def __len__(self):
+        return self.count
+
+    def cacheFile(self, filename):
+        # one for each listing, by its file name and extension
+        directory, name = os.path.split(filename)
+        return os.path.join(directory, CACHE_DIR, name.replace('.','-')+".npz")
+
+    def loadColumns(self, filename):
+        # the columns of a listing, from the cache if it is up to date, otherwise parsed from the listing and cached
+        source = os.stat(filename)
+        stamp = np.array([CACHE_VERSION, source.st_size, source.st_mtime_ns], dtype=np.int64)
+        cacheFile = self.cacheFile(filename)
+        try:
+            with np.load(cacheFile, allow_pickle=False) as data:
+                if np.array_equal(data['stamp'], stamp):
+                    return dict((name, data[name]) for name in data.files if name!='stamp')
+        except (OSError, ValueError, KeyError):
+            pass
+
+        print("Reading "+filename)
+        columns = parseListing(filename)
+        try:
+            os.makedirs(os.path.dirname(cacheFile), exist_ok=True)
+            tmpFile = "%s.%d.npz" % (cacheFile[0:-4], os.getpid())
+            np.savez(tmpFile, stamp=stamp, **columns)
+            os.replace(tmpFile, cacheFile)
+        except OSError as e:
+            print("Unable to cache heat pump listing: %s" % e)
+        return columns
+
+    def buildIndexes(self):
+        # {value: rows} for each of INDEXED_FIELDS and for ductless (True/False), the rows in increasing capacity
+        # (maximum at 47 deg F) and the first row for each AHRI certificate number
+        def index(values):
+            keys, inverse = np.unique(values, return_inverse=True)
+            order = np.argsort(inverse.reshape(-1), kind='stable')
+            bounds = np.cumsum(np.bincount(inverse.reshape(-1), minlength=len(keys)))
+            return dict(zip(keys.tolist(), np.split(order, bounds[:-1])))
+
+        self.indexes = dict((name, index(self.columns[field])) for name, field in INDEXED_FIELDS.items())
+        self.indexes['ductless'] = index(self.columns['DuctedDuctless']=='Ductless')
+
+        self.capacity = self.columns['CAPMax'][:,0]
+        self.capacityOrder = np.argsort(self.capacity, kind='stable')
+        self.sortedCapacity = self.capacity[self.capacityOrder]
+
+        self.certificates = {}
+        for row, cert in enumerate(self.columns['AHRICertNumber'].tolist()):
+            self.certificates.setdefault(cert, row)
+
+    def heatPump(self, row):
+        # the HeatPump for a row of the catalog
+        heatPump = self.heatPumpList[row]
+        if heatPump is None:
+            columns = self.columns
+            heatPump = HeatPump(**dict((field, str(columns[field][row])) for field in STRING_FIELDS))
+            n = 3 if np.isnan(columns['tData'][row,3]) else 4
+            tData = list(RATED_TEMPERATURES) + columns['tData'][row,3:n].tolist()
+            heatPump.setPerformanceData(tData, *[columns[field][row,0:n].tolist() for field in PERFORMANCE_FIELDS])
+            self.heatPumpList[row] = heatPump
+        return heatPump
+
+    def heatPumps(self, rows=None):
+        # HeatPump objects for rows of the catalog (all of them by default)
+        if rows is None:
+            rows = range(self.count)
+        return [self.heatPump(row) for row in rows]
+
+    def certificate(self, cert):
+        # the row of an AHRI certificate number, or None
+        return self.certificates.get(cert)
+
+    def select(self, manufacturer=None, brand=None, ductless=None, zones=None, capacity=None):
+        # rows (in catalog order) of the heat pumps matching all the criteria given:
+        # manufacturer, brand, zones - values of those fields; ductless - True or False;
+        # capacity - (lowest, highest) maximum capacity at 47 deg F, in Btu/hr, either of which may be None
+        # The rows of the smallest index matching are looked up in the others (each sorted) and their capacities
+        # checked, so the time taken is in proportion to the heat pumps found (with a log of the catalog size)
+        found = []
+        for name, value in (('manufacturer', manufacturer), ('brand', brand), ('ductless', ductless), ('zones', zones)):
+            if value is not None:
+                found.append(self.indexes[name].get(value, np.zeros(0, dtype=np.intp)))
+        if capacity is not None:
+            lowest, highest = capacity
+        if len(found)==0:
+            if capacity is None:
+                return np.arange(self.count)
+            # the rows in the capacity range
+            first = 0 if lowest is None else np.searchsorted(self.sortedCapacity, lowest, side='left')
+            last = self.count if highest is None else np.searchsorted(self.sortedCapacity, highest, side='right')
+            return np.sort(self.capacityOrder[first:last])
+
+        found.sort(key=len)
+        rows = found[0]
+        for other in found[1:]:
+            if len(rows)==0 or len(other)==0:
+                return np.zeros(0, dtype=np.intp)
+            position = np.minimum(np.searchsorted(other, rows), len(other)-1)
+            rows = rows[other[position]==rows]
+        if capacity is not None:
+            # (as for the sorted capacities, a heat pump with no capacity is above any highest)
+            capacities = self.capacity[rows]
+            inRange = np.ones(len(rows), dtype=bool)
+            if lowest is not None:
+                inRange &= ~(capacities < lowest)
+            if highest is not None:
+                inRange &= capacities <= highest
+            rows = rows[inRange]
+        return rows
@@ -0,0 +1,110 @@
+# Copyright (c) 2015 CSEC (Comprehensive Sustainable Energy Committee), Town of Concord
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Instrumentation of an analysis: the time taken by each stage, counts of the work done (hours simulated, files
+# parsed, cache hits), and optionally a cProfile profile of one analysis.
+#
+# Off unless turned on (see HeatPumpAnalysis.instrument), when the analysis times its stages with span() or
+# start()/stop(), and counts with count().  results() gives all of it as a dictionary, which can be saved as
+# JSON (see HeatPumpAnalysis.doHeatPumpAnalysis, which appends it next to the output report).
+
+import io
+import json
+import time
+import contextlib
+from collections import OrderedDict
+
+PROFILE_LINES = 40      # functions listed from the profile, by cumulative time
+
+class Instrumentation :
+    """Stage timings, counters and an optional profile of an analysis"""
+    def __init__(self, profile=False, save=False) :
+        self.profile = profile      # profile the next analysis (one only)
+        self.save = save            # save the results beside the output report
+        self.clear()
+
+    def clear(self):
+        self.spans = OrderedDict()      # [number of times, total seconds] by stage, in the order first started
+        self.counters = OrderedDict()
+        self.profileText = None         # the profile of the analysis, as printed by pstats
+        self.profiler = None            # (a cProfile.Profile, for saving or sorting otherwise)
+
+    def start(self, stage):
+        # start timing a stage, returning what stop() needs to end it
+        self.spans.setdefault(stage, [0, 0.])
+        return (stage, time.perf_counter())
+
+    def stop(self, span):
+        stage, start = span
+        self.spans[stage][0] += 1
+        self.spans[stage][1] += time.perf_counter() - start
+
+    @contextlib.contextmanager
+    def span(self, stage):
+        # time the stage inside the with block
+        span = self.start(stage)
+        try:
+            yield
+        finally:
+            self.stop(span)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextlib.contextmanager
+    def run(self, stage='analysis'):
+        # a whole analysis: the results start again, and it is profiled if asked for
+        self.clear()
+        profiler = None
+        if self.profile:
+            import cProfile
+            profiler = cProfile.Profile()
+            self.profile = False
+        span = self.start(stage)
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self.profiler = profiler
+            self.stop(span)
+
+    def profileStats(self):
+        # the profile as text, the functions taking the most time (with those they call) first
+        if self.profileText is None and self.profiler is not None:
+            import pstats
+            text = io.StringIO()
+            pstats.Stats(self.profiler, stream=text).sort_stats('cumulative').print_stats(PROFILE_LINES)
+            self.profileText = text.getvalue()
+        return self.profileText
+
+    def results(self):
+        return {'spans': OrderedDict((stage, {'calls':calls, 'seconds':seconds}) for stage, (calls, seconds) in self.spans.items()),
+                'counters': dict(self.counters),
+                'profile': self.profileStats()}
+
+    def saveResults(self, filename, **info):
+        # append the results, with any other information given, as a line of JSON
+        record = OrderedDict(info)
+        record.update(self.results())
+        with open(filename, 'a') as output:
+            output.write(json.dumps(record) + '\n')